@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+""" Stress test for sharing a single Client instance between many threads.
+
+    Usage:
+
+        python benchmarks/client_threads.py [--threads 64] [--calls 200] [--persistent]
+
+    Starts a minimal threaded stand-in for the Ext.Direct router on localhost,
+    which answers every call with its arguments and sets a new cookie value on
+    every response. The test fails if any TID is handed out twice, a response
+    is delivered to the wrong caller or the cookie jar ends up corrupted.
+"""
+
+import os
+import sys
+import json
+import time
+import optparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from djextdirect.client import Client
+
+API = {
+    "url":  "/api/router",
+    "type": "remoting",
+    "actions": { "Echo": [ {"name": "echo", "len": 2} ] },
+    }
+
+
+class RouterHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    protocol_version = "HTTP/1.1"
+    # Buffer the response so that headers and body go out in one segment
+    # (flushed by handle_one_request), otherwise kept-alive connections stall
+    # on Nagle's algorithm and delayed ACKs.
+    wbufsize = -1
+
+    def log_message( self, *args ):
+        pass
+
+    def do_POST( self ):
+        body = self.rfile.read( int( self.headers["Content-Length"] ) )
+        if self.path.endswith( "api.js" ):
+            out = "Ext.app.REMOTING_API = %s;" % json.dumps( API )
+        else:
+            req = json.loads( body )
+            self.server.seen_tid( req["tid"] )
+            out = json.dumps({ "type": "rpc", "tid": req["tid"], "action": req["action"],
+                               "method": req["method"], "result": req["data"] })
+        self.send_response( 200 )
+        self.send_header( "Content-Type", "application/json" )
+        self.send_header( "Content-Length", str(len(out)) )
+        self.send_header( "Set-Cookie", "sessionid=%s; Path=/" % self.server.next_session() )
+        self.end_headers()
+        self.wfile.write( out )
+
+
+class RouterServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    daemon_threads = False
+    request_queue_size = 128
+
+    def __init__( self, *args ):
+        BaseHTTPServer.HTTPServer.__init__( self, *args )
+        self.lock = threading.Lock()
+        self.tids = set()
+        self.duplicates = 0
+        self.sessions = 0
+
+    def handle_error( self, request, client_address ):
+        # kept-alive connections are cut off when the test exits
+        pass
+
+    def seen_tid( self, tid ):
+        self.lock.acquire()
+        try:
+            if tid in self.tids:
+                self.duplicates += 1
+            self.tids.add( tid )
+        finally:
+            self.lock.release()
+
+    def next_session( self ):
+        self.lock.acquire()
+        try:
+            self.sessions += 1
+            return "s%d" % self.sessions
+        finally:
+            self.lock.release()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option( "--threads", type="int", default=64 )
+    parser.add_option( "--calls",   type="int", default=200 )
+    parser.add_option( "--persistent", action="store_true", default=False )
+    options, args = parser.parse_args()
+
+    server = RouterServer( ( "127.0.0.1", 0 ), RouterHandler )
+    thr = threading.Thread( target=server.serve_forever )
+    thr.daemon = True
+    thr.start()
+
+    cli = Client( "http://127.0.0.1:%d/api/api.js" % server.server_port, persistent=options.persistent )
+
+    errors = []
+
+    def worker( idx ):
+        try:
+            for num in range( options.calls ):
+                result = cli.Echo.echo( idx, num )
+                if result != [idx, num]:
+                    errors.append( "thread %d got %r for call %d" % ( idx, result, num ) )
+        except Exception, err:
+            errors.append( "thread %d: %r" % ( idx, err ) )
+        finally:
+            cli.close()
+
+    started = time.time()
+    workers = [ threading.Thread( target=worker, args=(idx,) ) for idx in range( options.threads ) ]
+    for wrk in workers:
+        wrk.start()
+    for wrk in workers:
+        wrk.join()
+    elapsed = time.time() - started
+    cli.close()
+    server.shutdown()
+
+    total = options.threads * options.calls
+    print "%d calls from %d threads in %.2fs (%.0f calls/s)" % ( total, options.threads, elapsed, total / elapsed )
+    print "distinct tids: %d, duplicate tids: %d" % ( len(server.tids), server.duplicates )
+    print "cookie: %s" % cli.cookie
+
+    if cli.cookies.keys() != ["sessionid"]:
+        errors.append( "cookie jar corrupted: %r" % cli.cookies )
+    if server.duplicates or len(server.tids) != total:
+        errors.append( "tids were not unique" )
+
+    for err in errors[:20]:
+        print err
+    sys.exit( errors and 1 or 0 )
+
+
+if __name__ == '__main__':
+    main()
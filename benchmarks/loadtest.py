@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+""" End-to-end load test of the Client against a Provider.
+
+    Usage:
+
+        python benchmarks/loadtest.py [--workers 16] [--calls 200] [--batch 10]
+                                      [--depth 4] [--patterns single,batched,async]
+                                      [--methods echo,records,form,form_submit,sleep]
+                                      [--records 100] [--persistent] [--wire json]
+                                      [--instrument]
+
+    Boots a threaded local Django server (wsgiref) on an sqlite database in a
+    temporary file, with a synthetic API: a Bench action that echoes its
+    argument, reads records from the database or sleeps, and a ModelForm
+    registered with a FormProvider, the get method of which is called as well.
+    The form_submit method submits that form the way Ext's BasicForm does,
+    as an urlencoded POST that the router hands to update_form_data. Form
+    submissions can't be batched, so the batched pattern sends them on their
+    own.
+
+    Then every selected call pattern is run by the given number of concurrent
+    workers, each of which makes the given number of calls:
+
+        single:   one call per request, through Client.call().
+        batched:  --batch calls per request, sent as a single Ext.Direct batch.
+        async:    every worker keeps --depth calls in flight at the same time.
+
+    For every pattern, the throughput and a histogram of the latencies seen by
+    the client (per request for batches, per call otherwise) are printed, along
+    with the time spent per method on the server side as reported by the
+    Provider's metrics hook. Throughput only counts calls that succeeded.
+
+    With --instrument, the Provider records the queries made by every call,
+    which on older Django versions means running with the debug cursor, so
+    the timings it reports are slightly higher.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import urllib
+import tempfile
+import optparse
+import threading
+import SocketServer
+from multiprocessing.pool import ThreadPool
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from django.conf import settings
+
+DBFILE_FD, DBFILE = tempfile.mkstemp( prefix="djextdirect-loadtest-", suffix=".sqlite" )
+os.close( DBFILE_FD )
+
+settings.configure(
+    DEBUG=False,
+    SECRET_KEY="loadtest",
+    ALLOWED_HOSTS=["*"],
+    ROOT_URLCONF=__name__,
+    MIDDLEWARE_CLASSES=(),
+    INSTALLED_APPS=(),
+    DATABASES={
+        "default": { "ENGINE": "django.db.backends.sqlite3", "NAME": DBFILE },
+        },
+    )
+
+from django import forms
+from django.db import models, connection
+from django.conf.urls import patterns, include
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.color import no_style
+
+from djextdirect.formprovider import FormProvider
+from djextdirect.client import Client
+
+# Latency histogram buckets, upper bounds in milliseconds.
+BUCKETS = [ 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000 ]
+
+# Set up by setup_app(), resolved by Django on the first request.
+urlpatterns = []
+
+
+class Record( models.Model ):
+    name    = models.CharField( max_length=50 )
+    value   = models.IntegerField( default=0 )
+    comment = models.TextField( blank=True )
+
+    class Meta:
+        app_label = "loadtest"
+
+
+class RecordForm( forms.ModelForm ):
+    class Meta:
+        model = Record
+
+
+class Timings( object ):
+    """ Thread-safe collection of latencies by key. """
+
+    def __init__( self ):
+        self.lock    = threading.Lock()
+        self.samples = {}
+        self.errors  = {}
+        self.failed  = 0
+
+    def add( self, key, elapsed, error=None ):
+        self.lock.acquire()
+        try:
+            self.samples.setdefault( key, [] ).append( elapsed )
+            if error is not None:
+                self.errors[key] = self.errors.get( key, 0 ) + 1
+        finally:
+            self.lock.release()
+
+    def add_failed( self, count ):
+        """ Count calls that failed on the client side. """
+        self.lock.acquire()
+        try:
+            self.failed += count
+        finally:
+            self.lock.release()
+
+    def metrics( self, action, method, elapsed, error, stats ):
+        """ Metrics hook for the Provider. """
+        self.add( "%s.%s" % ( action, method ), elapsed, error )
+
+    def clear( self ):
+        self.lock.acquire()
+        try:
+            self.samples = {}
+            self.errors  = {}
+            self.failed  = 0
+        finally:
+            self.lock.release()
+
+
+class QuietHandler( WSGIRequestHandler ):
+    def log_message( self, *args ):
+        pass
+
+
+class ThreadingWSGIServer( SocketServer.ThreadingMixIn, WSGIServer ):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def percentile( samples, pct ):
+    """ Return the given percentile of a sorted list. """
+    return samples[ min( len(samples) - 1, int( len(samples) * pct / 100.0 ) ) ]
+
+
+def print_histogram( samples ):
+    samples = sorted( samples )
+    if not samples:
+        return
+    counts = [ 0 ] * ( len(BUCKETS) + 1 )
+    for elapsed in samples:
+        counts[ bisect.bisect_left( BUCKETS, elapsed * 1000 ) ] += 1
+    print "    latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % tuple([
+        percentile( samples, pct ) * 1000 for pct in ( 50, 90, 99 ) ] + [ samples[-1] * 1000 ])
+    for idx, count in enumerate( counts ):
+        if not count:
+            continue
+        if idx < len(BUCKETS):
+            label = "<= %5d" % BUCKETS[idx]
+        else:
+            label = " > %5d" % BUCKETS[-1]
+        print "    %s ms %7d %s" % ( label, count, "#" * int( 50.0 * count / len(samples) ) )
+
+
+def print_server_timings( timings ):
+    print "    server side:"
+    for key in sorted( timings.samples ):
+        samples = sorted( timings.samples[key] )
+        print "      %-24s %7d calls  mean %7.2f ms  p99 %7.2f ms  errors %d" % (
+            key, len(samples), sum(samples) / len(samples) * 1000,
+            percentile( samples, 99 ) * 1000, timings.errors.get( key, 0 ) )
+
+
+def setup_app( options, timings ):
+    """ Create the database and register the synthetic API. """
+    global urlpatterns
+
+    sql, references = connection.creation.sql_create_model( Record, no_style() )
+    cursor = connection.cursor()
+    for statement in sql:
+        cursor.execute( statement )
+    Record.objects.bulk_create([
+        Record( name="record %d" % idx, value=idx, comment="x" * ( idx % 200 ) )
+        for idx in range( options.records ) ])
+    connection.close()
+
+    provider = FormProvider( instrument=options.instrument, metrics=timings.metrics )
+
+    @provider.register_method( "Bench" )
+    def echo( request, value ):
+        return value
+
+    @provider.register_method( "Bench" )
+    def records( request, limit ):
+        return list( Record.objects.values( "id", "name", "value" )[:limit] )
+
+    @provider.register_method( "Bench" )
+    def sleep( request, msecs ):
+        time.sleep( msecs / 1000. )
+        return msecs
+
+    provider.register_form( RecordForm )
+
+    urlpatterns = patterns( '', ( r'^api/', include( provider.urls ) ) )
+
+
+def make_calls( options ):
+    """ Return the list of (action, method, args) tuples the workers cycle through.
+
+        For form submissions, args is a dict of form fields instead of a list.
+    """
+    available = {
+        "echo":    ( "Bench", "echo", [ { "text": "hello", "list": range(10) } ] ),
+        "records": ( "Bench", "records", [ 20 ] ),
+        "form":    ( "XD_RecordForm", "get", [ 1 ] ),
+        "form_submit": ( "XD_RecordForm", "update",
+                         { "pk": 1, "name": "record 1", "value": 1, "comment": "submitted" } ),
+        "sleep":   ( "Bench", "sleep", [ options.sleep ] ),
+        }
+    return [ available[name] for name in options.methods.split(",") ]
+
+
+def is_form_submit( call ):
+    return isinstance( call[2], dict )
+
+
+def submit_form( cli, action, method, fields ):
+    """ Submit form fields to the router like Ext's BasicForm does, and raise
+        an exception unless the submission succeeded.
+    """
+    data = dict( fields, extAction=action, extMethod=method, extType="rpc",
+                 extUpload="false", extTID=cli.tid )
+    status, reason, body, cookies, ctype = cli.post( cli.routerurl, urllib.urlencode( data ),
+        cli.timeout, "application/x-www-form-urlencoded" )
+    if status != 200:
+        raise Exception( status, reason )
+    response = json.loads( body )
+    if response.get("type") != "rpc" or not response["result"].get("success"):
+        raise Exception( response )
+
+
+def timed_call( cli, call, timings ):
+    action, method, args = call
+    started = time.time()
+    try:
+        if is_form_submit( call ):
+            submit_form( cli, action, method, args )
+        else:
+            cli.call( action, method, *args )
+    except Exception, err:
+        timings.add( "client", time.time() - started, err )
+        timings.add_failed( 1 )
+    else:
+        timings.add( "client", time.time() - started )
+
+
+def run_single( cli, calls, options, timings ):
+    for num in range( options.calls ):
+        timed_call( cli, calls[ num % len(calls) ], timings )
+
+
+def run_batched( cli, calls, options, timings ):
+    if cli.wire == "msgpack":
+        from djextdirect import codec
+        encode, decode, content_type = codec.packb, codec.unpackb, codec.MSGPACK_MIMETYPE
+    else:
+        encode, decode, content_type = json.dumps, json.loads, "application/json"
+
+    for first in range( 0, options.calls, options.batch ):
+        batch = []
+        for num in range( first, min( first + options.batch, options.calls ) ):
+            call = calls[ num % len(calls) ]
+            if is_form_submit( call ):
+                timed_call( cli, call, timings )
+                continue
+            action, method, args = call
+            batch.append({ "tid": cli.tid, "action": action, "method": method, "data": args, "type": "rpc" })
+        if not batch:
+            continue
+        started = time.time()
+        try:
+            status, reason, body, cookies, ctype = cli.post( cli.routerurl, encode( batch ), cli.timeout, content_type )
+            if status != 200:
+                raise Exception( status, reason )
+            responses = decode( body )
+        except Exception, err:
+            timings.add( "client", time.time() - started, err )
+            timings.add_failed( len(batch) )
+            continue
+        if not isinstance( responses, list ):
+            responses = [ responses ]
+        failed = len(batch) - len([ resp for resp in responses if resp.get("type") == "rpc" ])
+        if failed:
+            timings.add( "client", time.time() - started, failed )
+            timings.add_failed( failed )
+        else:
+            timings.add( "client", time.time() - started )
+
+
+def run_async( cli, calls, options, timings ):
+    pool = ThreadPool( options.depth )
+    try:
+        pool.map( lambda num: timed_call( cli, calls[ num % len(calls) ], timings ),
+                  range( options.calls ), chunksize=1 )
+    finally:
+        pool.close()
+        pool.join()
+
+
+PATTERNS = {
+    "single":  run_single,
+    "batched": run_batched,
+    "async":   run_async,
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option( "--workers",  type="int", default=16 )
+    parser.add_option( "--calls",    type="int", default=200, help="calls per worker and pattern" )
+    parser.add_option( "--batch",    type="int", default=10,  help="calls per batch in the batched pattern" )
+    parser.add_option( "--depth",    type="int", default=4,   help="calls in flight per worker in the async pattern" )
+    parser.add_option( "--patterns", default="single,batched,async" )
+    parser.add_option( "--methods",  default="echo,records,form",
+                       help="comma-separated list of echo, records, form, form_submit and sleep" )
+    parser.add_option( "--records",  type="int", default=100, help="rows in the records table" )
+    parser.add_option( "--sleep",    type="int", default=10,  help="milliseconds Bench.sleep sleeps" )
+    parser.add_option( "--wire",     default="json" )
+    parser.add_option( "--persistent", action="store_true", default=False )
+    parser.add_option( "--instrument", action="store_true", default=False, help="record queries per call" )
+    options, args = parser.parse_args()
+
+    timings = Timings()
+    try:
+        setup_app( options, timings )
+
+        server = ThreadingWSGIServer( ( "127.0.0.1", 0 ), QuietHandler )
+        server.set_app( WSGIHandler() )
+        thr = threading.Thread( target=server.serve_forever )
+        thr.daemon = True
+        thr.start()
+
+        cli = Client( "http://127.0.0.1:%d/api/api.js" % server.server_port,
+                      persistent=options.persistent, wire=options.wire )
+        calls = make_calls( options )
+
+        for name in options.patterns.split(","):
+            func = PATTERNS[name]
+            timings.clear()
+
+            def worker():
+                try:
+                    func( cli, calls, options, timings )
+                finally:
+                    cli.close()
+
+            started = time.time()
+            workers = [ threading.Thread( target=worker ) for idx in range( options.workers ) ]
+            for wrk in workers:
+                wrk.start()
+            for wrk in workers:
+                wrk.join()
+            elapsed = time.time() - started
+
+            client  = timings.samples.pop( "client", [] )
+            timings.errors.pop( "client", None )
+            total   = options.workers * options.calls
+            print "%s: %d calls in %d requests from %d workers in %.2fs (%.0f calls/s, %.0f requests/s, %d failed calls)" % (
+                name, total, len(client), options.workers, elapsed, ( total - timings.failed ) / elapsed,
+                len(client) / elapsed, timings.failed )
+            print_histogram( client )
+            print_server_timings( timings )
+
+        server.shutdown()
+    finally:
+        if os.path.exists( DBFILE ):
+            os.unlink( DBFILE )
+
+
+if __name__ == '__main__':
+    main()
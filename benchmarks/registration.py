@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+""" Measure the boot-time cost of importing djextdirect and registering methods.
+
+    Usage:
+
+        python benchmarks/registration.py [--actions 50] [--methods 20] [--rounds 5]
+
+    Every round creates a fresh Provider, registers actions * methods freshly
+    defined functions to it and then builds the URL patterns, which is what a
+    worker does on boot. The cost of the first API build (which introspects
+    the method signatures) is reported separately.
+"""
+
+import os
+import sys
+import time
+import optparse
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from django.conf import settings
+
+settings.configure(
+    DEBUG=False,
+    )
+
+
+def make_method( idx ):
+    """ Define a new function, just like importing a module full of remote methods would. """
+    namespace = {}
+    exec "def method_%d( request, foo, bar, baz=None ):\n    return foo" % idx in namespace
+    return namespace["method_%d" % idx]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option( "--actions", type="int", default=50 )
+    parser.add_option( "--methods", type="int", default=20 )
+    parser.add_option( "--rounds",  type="int", default=5 )
+    options, args = parser.parse_args()
+
+    start = time.time()
+    from djextdirect.provider import Provider
+    print "import:          %8.2f ms" % ( ( time.time() - start ) * 1000 )
+
+    total = options.actions * options.methods
+    for rnd in range( options.rounds ):
+        funcs = [ make_method( idx ) for idx in range( total ) ]
+
+        start = time.time()
+        provider = Provider()
+        for idx, func in enumerate( funcs ):
+            provider.register_method( "Action%d" % ( idx % options.actions ) )( func )
+        for _ in range( 100 ):
+            provider.urls
+        boot = time.time() - start
+
+        start = time.time()
+        provider.build_api_dict()
+        apibuild = time.time() - start
+
+        print "round %d: registering %d methods + 100 url accesses: %8.2f ms, first API build: %8.2f ms" % (
+            rnd, total, boot * 1000, apibuild * 1000 )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import hmac
+import json
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+
+
+def get_payload( request ):
+    """ Return the decoded JSON body of the request, reusing the one decoded by
+        the router if possible. Raises ValueError if the body is not valid JSON.
+    """
+    payload = getattr( request, "EXT_rawjson", None )
+    if payload is None:
+        payload = json.loads( request.body )
+    return payload
+
+
+def get_credentials( payload ):
+    """ Return a tuple of (username, password) sent in the payload, which may
+        be a single call or a batch of calls.
+    """
+    if isinstance( payload, list ):
+        for reqinfo in payload:
+            if isinstance( reqinfo, dict ) and reqinfo.get('username'):
+                payload = reqinfo
+                break
+        else:
+            return None, None
+    if not isinstance( payload, dict ):
+        return None, None
+    return payload.get('username', None), payload.get('password', None)
+
+
+def password_digest( user ):
+    """ Return a keyed digest of the user's password hash, which is what the
+        auth cache stores to detect password changes.
+    """
+    return hmac.new( force_bytes( settings.SECRET_KEY ),
+        "djextdirect:pwhash\0%s" % force_bytes( user.password ), hashlib.sha256 ).hexdigest()
+
+
+def authenticate_cached( username, password ):
+    """ Authenticate the user like django.contrib.auth.authenticate does, but
+        remember successful logins for EXTDIRECT_AUTH_CACHE_TIMEOUT seconds
+        (default 60, 0 disables the cache), so that clients sending their
+        credentials with every call do not pay for password hashing each time.
+
+        Neither the password nor its hash end up in the cache, which only
+        stores the user's pk, the backend and a keyed digest of the password
+        hash. Entries are invalidated when the user's password changes.
+    """
+    from django.contrib.auth import authenticate, get_user_model
+
+    timeout = getattr( settings, "EXTDIRECT_AUTH_CACHE_TIMEOUT", 60 )
+    if not timeout:
+        return authenticate( username=username, password=password )
+
+    key = "djextdirect:auth:" + hmac.new( force_bytes( settings.SECRET_KEY ),
+        "%s\0%s" % ( force_bytes( username ), force_bytes( password ) ), hashlib.sha256 ).hexdigest()
+
+    cached = cache.get( key )
+    if cached is not None:
+        userid, backend, pwdigest = cached
+        try:
+            user = get_user_model()._default_manager.get( pk=userid )
+        except get_user_model().DoesNotExist:
+            user = None
+        if user is not None and constant_time_compare( password_digest( user ), pwdigest ):
+            user.backend = backend
+            return user
+        cache.delete( key )
+
+    user = authenticate( username=username, password=password )
+    if user is not None:
+        cache.set( key, ( user.pk, user.backend, password_digest( user ) ), timeout )
+    return user
+
+
+def sign_request( secret, method, path, timestamp, body ):
+    """ Return the signature of a request with the given HTTP method, path and
+        body sent at timestamp.
+    """
+    return hmac.new( force_bytes( secret ), "%s\n%s\n%s\n%s" % (
+        force_bytes( method ), force_bytes( path ), timestamp, body ), hashlib.sha256 ).hexdigest()
+
+
+def authenticate_signed( request ):
+    """ Authenticate a request signed with an API key, as sent by the Client if
+        api_key and api_secret are given.
+
+        API keys are configured in the EXTDIRECT_API_KEYS setting, which maps
+        key ids to a tuple of (username, secret). The signature covers the
+        HTTP method, the path, the timestamp and the body. Signatures are only
+        accepted for EXTDIRECT_SIGNATURE_MAX_AGE seconds (default 300), and
+        only once: they are remembered in the cache for that time, so that a
+        captured request cannot be replayed.
+
+        Returns the user, or None if the request is not signed or the signature
+        is invalid.
+    """
+    # Methods of a batch may check the same request more than once.
+    if hasattr( request, "EXT_signed_user" ):
+        return request.EXT_signed_user
+    request.EXT_signed_user = None
+
+    keyid = request.META.get("HTTP_X_EXTDIRECT_KEY")
+    keys  = getattr( settings, "EXTDIRECT_API_KEYS", {} )
+    if not keyid or keyid not in keys:
+        return None
+
+    timestamp = request.META.get("HTTP_X_EXTDIRECT_TIMESTAMP", "")
+    signature = request.META.get("HTTP_X_EXTDIRECT_SIGNATURE", "")
+    try:
+        age = abs( time.time() - int(timestamp) )
+    except ValueError:
+        return None
+    maxage = getattr( settings, "EXTDIRECT_SIGNATURE_MAX_AGE", 300 )
+    if age > maxage:
+        return None
+
+    username, secret = keys[keyid]
+    if not constant_time_compare( sign_request( secret, request.method, request.path, timestamp, request.body ), signature ):
+        return None
+
+    # Timestamps are accepted up to maxage seconds into the past and future.
+    if not cache.add( "djextdirect:sig:%s:%s" % ( keyid, signature ), True, 2 * maxage + 1 ):
+        return None
+
+    from django.contrib.auth import get_user_model
+    UserModel = get_user_model()
+    try:
+        user = UserModel._default_manager.get_by_natural_key( username )
+    except UserModel.DoesNotExist:
+        return None
+    if not user.is_active:
+        return None
+    request.EXT_signed_user = user
+    return user
@@ -15,11 +15,21 @@
  *  GNU General Public License for more details.
 """
 
+import hmac
 import json
+import time
+import hashlib
+import socket
+import shelve
 import httplib
-from threading import Lock
+import itertools
+from Cookie import SimpleCookie, CookieError
+from threading import Lock, local
+from collections import OrderedDict
 from urlparse import urljoin, urlparse
 
+import codec
+
 
 def lexjs(javascript):
     """ Parse the given javascript and return a dict of variables defined in there. """
@@ -68,6 +78,158 @@ class ReturnedError(Exception):
     pass
 
 
+class CircuitOpenError(RequestError):
+    """ Raised if a call is refused because the circuit breaker is open. """
+    pass
+
+
+# Status codes that indicate a temporary problem on the server side.
+TRANSIENT_STATUS = ( 502, 503, 504 )
+
+TRANSIENT_ERRORS = ( RequestError, socket.error, httplib.HTTPException )
+
+def is_transient( err ):
+    """ Check if the given error is worth retrying the call. """
+    if isinstance( err, RequestError ):
+        return bool(err.args) and err.args[0] in TRANSIENT_STATUS
+    return True
+
+
+def is_connection_closed( err ):
+    """ Check if the given BadStatusLine means that the server closed the
+        connection without sending anything.
+    """
+    return not err.line or err.line.startswith( "No status line received" )
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker to fail fast while the server is unhealthy.
+
+        After threshold consecutive failed calls, the breaker opens and
+        refuses all calls for reset_timeout seconds. Then a single call is
+        let through: if it succeeds, the breaker closes again, otherwise it
+        stays open for another reset_timeout seconds.
+
+        A breaker can be shared between multiple clients talking to the same
+        server.
+    """
+
+    def __init__( self, threshold=5, reset_timeout=30 ):
+        self.threshold     = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened   = None
+        self.lock     = Lock()
+
+    def allow( self ):
+        """ Check if a call may be made. """
+        self.lock.acquire()
+        try:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.reset_timeout:
+                # half-open: let this call through, but refuse others until it returns
+                self.opened = time.time()
+                return True
+            return False
+        finally:
+            self.lock.release()
+
+    def success( self ):
+        self.lock.acquire()
+        try:
+            self.failures = 0
+            self.opened   = None
+        finally:
+            self.lock.release()
+
+    def failure( self ):
+        self.lock.acquire()
+        try:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+        finally:
+            self.lock.release()
+
+
+class ResponseCache(object):
+    """ Cache for the results of read-only methods.
+
+        Results are kept in memory in an LRU of maxsize entries, and expire
+        after ttl seconds. If path is given, results are additionally stored
+        on disk using shelve, so they survive across runs.
+
+        The cache is thread-safe and can be shared between multiple clients.
+    """
+
+    def __init__( self, maxsize=1000, ttl=60, path=None ):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self.entries = OrderedDict()
+        self.lock    = Lock()
+        if path is not None:
+            self.store = shelve.open( path )
+        else:
+            self.store = None
+
+    def key( self, action, method, args ):
+        """ Return the cache key for a call. """
+        return json.dumps( [action, method, args], sort_keys=True )
+
+    def get( self, key ):
+        """ Return a tuple of (hit, result) for the given key. """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                expires, result = self.entries.pop( key )
+            elif self.store is not None and key in self.store:
+                expires, result = self.store[key]
+            else:
+                return False, None
+            if expires < now:
+                if self.store is not None and key in self.store:
+                    del self.store[key]
+                return False, None
+            # re-insert to mark as most recently used
+            self.entries[key] = ( expires, result )
+            return True, result
+        finally:
+            self.lock.release()
+
+    def set( self, key, result, ttl=None ):
+        """ Store the result for the given key. """
+        if ttl is None:
+            ttl = self.ttl
+        entry = ( time.time() + ttl, result )
+        self.lock.acquire()
+        try:
+            self.entries.pop( key, None )
+            self.entries[key] = entry
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem( last=False )
+            if self.store is not None:
+                self.store[key] = entry
+        finally:
+            self.lock.release()
+
+    def clear( self ):
+        """ Remove all entries. """
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            if self.store is not None:
+                self.store.clear()
+        finally:
+            self.lock.release()
+
+    def close( self ):
+        """ Close the on-disk store, if any. """
+        if self.store is not None:
+            self.store.close()
+
+
 class Client(object):
     """ Ext.Direct client side implementation.
 
@@ -99,46 +261,90 @@ class Client(object):
 
         >>> cli.Accounts.login( "svedrin", "passwort" )
         {'success': True}
+
+        Results of methods that are registered with the readOnly flag can be
+        cached by passing a ResponseCache instance:
+
+        >>> @EXT_JS_PROVIDER.register_method( "Accounts", flags={"readOnly": True} )
+        ... def lookup( request, name ):
+        ...    return Account.objects.get( name=name ).id
+
+        >>> cli = Client( "http://localhost:8000/mumble/api/api.js", cache=ResponseCache( ttl=300 ) )
+
+        Calls are cached by action, method and arguments. The cacheTTL flag
+        can be used to override the cache's ttl for a specific method.
+
+        Further parameters to tune the client's behaviour on failures:
+
+        timeout:          Timeout in seconds for each request (default: none).
+        method_timeouts:  A dict that maps "Action.method" to a timeout that
+                          overrides the default timeout for that method.
+        retries:          How often to retry calls to methods flagged readOnly
+                          or idempotent after connection errors, timeouts or
+                          502/503/504 responses. Other methods are never retried.
+        backoff:          Seconds to wait before the first retry, doubled for
+                          every further retry.
+        breaker:          A CircuitBreaker instance.
+        on_call:          A function that is called after each request with the
+                          action, method, elapsed time in seconds and the error
+                          raised (or None), for collecting metrics.
+
+        If api_key and api_secret are given, every request is signed with them,
+        which lets methods decorated with require_authorization authenticate
+        the client without a session or password (see EXTDIRECT_API_KEYS).
+
+        If wire is "msgpack", requests and responses are encoded in MessagePack
+        instead of JSON (this requires the msgpack package on both ends). Dates,
+        times and Decimals in results are then decoded to the same types.
+
+        A Client instance can be shared between threads. If persistent is True,
+        every thread keeps its own keep-alive connection to the server instead
+        of connecting for every call.
     """
 
-    def get_post_data(self, data=None):
+    def get_post_data(self, data=None, wire="json"):
         """
-        Adds username and password into post data
+        Adds username and password into post data and encodes it for the given wire format
         """
         if not data:
             data = {}
         data["username"] = self.username
         data["password"] = self.password
+        if wire == "msgpack":
+            return codec.packb(data)
         return json.dumps(data)
 
-    def __init__( self, apiurl, apiname="Ext.app.REMOTING_API", cookie=None, username=None, password=None ):
+    def __init__( self, apiurl, apiname="Ext.app.REMOTING_API", cookie=None, username=None, password=None, cache=None,
+                  timeout=None, method_timeouts=None, retries=0, backoff=0.1, breaker=None, on_call=None,
+                  persistent=False, api_key=None, api_secret=None, wire="json" ):
         self.apiurl  = apiurl
         self.apiname = apiname
         self.cookie  = cookie
         self.username = username
         self.password = password
-
-        data = self.get_post_data()
-        purl = urlparse(self.apiurl)
-        conn = {
-            "http":  httplib.HTTPConnection,
-            "https": httplib.HTTPSConnection
-        }[purl.scheme.lower()](purl.netloc)
-        conn.putrequest( "POST", purl.path )
-        conn.putheader( "Content-Type", "application/json" )
-        conn.putheader( "Content-Length", str(len(data)) )
-        if self.cookie:
-            conn.putheader( "Cookie", self.cookie )
-        conn.endheaders()
-        conn.send( data )
-
-        resp = conn.getresponse()
-
-        if resp.status != 200:
-            raise RequestError( resp.status, resp.reason )
-
-        foundvars = lexjs(resp.read())
-        conn.close()
+        self.cache    = cache
+        self.timeout  = timeout
+        self.method_timeouts = method_timeouts or {}
+        self.retries  = retries
+        self.backoff  = backoff
+        self.breaker  = breaker
+        self.on_call  = on_call
+        self.persistent = persistent
+        self.api_key    = api_key
+        self.api_secret = api_secret
+        if wire not in ( "json", "msgpack" ):
+            raise ValueError( "Unknown wire format '%s'" % wire )
+        if wire == "msgpack" and not codec.available():
+            raise ValueError( "The msgpack wire format requires the msgpack package" )
+        self.wire       = wire
+        self._local   = local()
+
+        status, reason, body, cookies, ctype = self.post( self.apiurl, self.get_post_data(), self.timeout )
+
+        if status != 200:
+            raise RequestError( status, reason )
+
+        foundvars = lexjs(body)
 
         if not self.apiname in foundvars:
             raise Exception("Wrong apiname '{apiname}'".format(apiname=self.apiname))
@@ -146,23 +352,204 @@ class Client(object):
         self.api = foundvars[self.apiname]
         self.routerurl = urljoin(self.apiurl, self.api["url"])
 
-        self._tid = 1
-        self._tidlock = Lock()
+        self._tids = itertools.count(2)
 
+        self.methspecs = {}
         for action in self.api['actions']:
+            for methspec in self.api['actions'][action]:
+                self.methspecs[ (action, methspec['name']) ] = methspec
             setattr( self, action, self.get_object(action) )
 
     @property
     def tid( self ):
         """ Thread-safely get a new TID. """
-        self._tidlock.acquire()
-        self._tid += 1
-        newtid = self._tid
-        self._tidlock.release()
-        return newtid
+        # count.next() is atomic, so there is no need for locking.
+        return self._tids.next()
+
+    def _get_cookie( self ):
+        """ The Cookie header sent with each request. """
+        return "; ".join([ "%s=%s" % item for item in self.cookies.items() ]) or None
+
+    def _set_cookie( self, cookie ):
+        self.cookies = {}
+        if cookie:
+            for morsel in cookie.split(";"):
+                if "=" in morsel:
+                    name, value = morsel.split("=", 1)
+                    self.cookies[name.strip()] = value.strip()
+
+    cookie = property( _get_cookie, _set_cookie )
+
+    def update_cookies( self, headers ):
+        """ Update the cookie jar from the given Set-Cookie headers. """
+        for header in headers:
+            try:
+                parsed = SimpleCookie( header )
+            except CookieError:
+                continue
+            for name in parsed:
+                # single item assignment is atomic, so concurrent updates don't race
+                self.cookies[name] = parsed[name].value
+
+    def get_connection( self, purl, timeout ):
+        """ Return a tuple of (connection, reused). If persistent connections
+            are enabled, the connection is kept per thread and server.
+        """
+        connclass = {
+            "http":  httplib.HTTPConnection,
+            "https": httplib.HTTPSConnection
+        }[purl.scheme.lower()]
+        if not self.persistent:
+            return connclass( purl.netloc, timeout=timeout ), False
+
+        if not hasattr( self._local, "connections" ):
+            self._local.connections = {}
+        key = ( purl.scheme.lower(), purl.netloc )
+        conn = self._local.connections.get( key )
+        if conn is not None and conn.sock is not None:
+            conn.timeout = timeout
+            conn.sock.settimeout( timeout )
+            return conn, True
+        conn = connclass( purl.netloc, timeout=timeout )
+        self._local.connections[key] = conn
+        return conn, False
+
+    def close( self ):
+        """ Close the persistent connections of the calling thread. """
+        for conn in getattr( self._local, "connections", {} ).values():
+            conn.close()
+        self._local.connections = {}
+
+    def post( self, url, data, timeout=None, content_type="application/json" ):
+        """ POST data to the given URL and return a tuple of
+            (status, reason, body, Set-Cookie headers, Content-Type).
+        """
+        purl = urlparse( url )
+        conn, reused = self.get_connection( purl, timeout )
+        try:
+            # If the server has closed a kept-alive connection, sending the
+            # request fails or the response is empty. Try again once with a
+            # fresh connection in that case, but not after errors that happen
+            # once the server may have processed the request (like timeouts):
+            # retrying those is up to the retry policy in call_uncached.
+            try:
+                self._send( conn, purl, data, content_type )
+            except socket.timeout:
+                raise
+            except socket.error:
+                if not reused:
+                    raise
+                conn.close()
+                self._send( conn, purl, data, content_type )
+                reused = False
+            try:
+                return self._receive( conn )
+            except httplib.BadStatusLine, err:
+                if not reused or not is_connection_closed( err ):
+                    raise
+                conn.close()
+                self._send( conn, purl, data, content_type )
+                return self._receive( conn )
+        except:
+            conn.close()
+            raise
+        finally:
+            if not self.persistent:
+                conn.close()
+
+    def _send( self, conn, purl, data, content_type ):
+        # The headers are sent along with the body, which may contain binary
+        # data, so keep unicode (e.g. the router URL from the API) out of them.
+        path = purl.path.encode("utf-8")
+        conn.putrequest( "POST", path )
+        conn.putheader( "Content-Type", content_type )
+        conn.putheader( "Accept", content_type )
+        conn.putheader( "Content-Length", str(len(data)) )
+        cookie = self.cookie
+        if cookie:
+            conn.putheader( "Cookie", cookie.encode("utf-8") )
+        if self.api_key:
+            timestamp = str(int(time.time()))
+            conn.putheader( "X-ExtDirect-Key", self.api_key )
+            conn.putheader( "X-ExtDirect-Timestamp", timestamp )
+            conn.putheader( "X-ExtDirect-Signature",
+                hmac.new( self.api_secret, "POST\n%s\n%s\n%s" % ( path, timestamp, data ), hashlib.sha256 ).hexdigest() )
+        # Send headers and body in one go, to avoid delays caused by Nagle's
+        # algorithm and delayed ACKs on kept-alive connections.
+        conn.endheaders( data )
+
+    def _receive( self, conn ):
+        resp = conn.getresponse()
+        return resp.status, resp.reason, resp.read(), resp.msg.getheaders( "set-cookie" ), resp.getheader( "content-type", "" )
 
     def call( self, action, method, *args ):
-        """ Make a call to Ext.Direct. """
+        """ Make a call to Ext.Direct, or return the cached result for read-only methods. """
+        methspec = self.methspecs.get( (action, method), {} )
+        if self.cache is None or not methspec.get('readOnly'):
+            return self.call_uncached( action, method, *args )
+
+        key = self.cache.key( action, method, args )
+        hit, result = self.cache.get( key )
+        if not hit:
+            result = self.call_uncached( action, method, *args )
+            self.cache.set( key, result, methspec.get('cacheTTL') )
+        return result
+
+    def call_uncached( self, action, method, *args ):
+        """ Make a call to Ext.Direct, retrying transient failures of methods
+            that are flagged readOnly or idempotent.
+        """
+        methspec = self.methspecs.get( (action, method), {} )
+        timeout  = self.method_timeouts.get( "%s.%s" % ( action, method ), self.timeout )
+        if methspec.get('readOnly') or methspec.get('idempotent'):
+            attempts = self.retries + 1
+        else:
+            attempts = 1
+
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                self.report( action, method, 0, CircuitOpenError( 'circuit open' ) )
+                raise CircuitOpenError( 'circuit open' )
+
+            started = time.time()
+            try:
+                result = self.send_call( action, method, args, timeout )
+
+            except ReturnedError, err:
+                # The server is fine, the method itself failed.
+                if self.breaker is not None:
+                    self.breaker.success()
+                self.report( action, method, time.time() - started, err )
+                raise
+
+            except TRANSIENT_ERRORS, err:
+                # Only server trouble counts against the breaker, not errors
+                # like 403 or 404 that a misconfigured client would get.
+                if self.breaker is not None:
+                    if is_transient( err ):
+                        self.breaker.failure()
+                    else:
+                        self.breaker.success()
+                self.report( action, method, time.time() - started, err )
+                attempt += 1
+                if attempt >= attempts or not is_transient( err ):
+                    raise
+                time.sleep( self.backoff * 2 ** ( attempt - 1 ) )
+
+            else:
+                if self.breaker is not None:
+                    self.breaker.success()
+                self.report( action, method, time.time() - started, None )
+                return result
+
+    def report( self, action, method, elapsed, error ):
+        """ Pass the outcome of a call to the on_call metrics hook, if any. """
+        if self.on_call is not None:
+            self.on_call( action, method, elapsed, error )
+
+    def send_call( self, action, method, args, timeout=None ):
+        """ Send a single call to the router and return its result. """
         reqtid = self.tid
         data = self.get_post_data({
             'tid':    reqtid,
@@ -170,36 +557,29 @@ class Client(object):
             'method': method,
             'data':   args,
             'type':   'rpc'
-        })
+        }, self.wire)
 
-        purl = urlparse( self.routerurl )
-        conn = {
-            "http":  httplib.HTTPConnection,
-            "https": httplib.HTTPSConnection
-        }[purl.scheme.lower()](purl.netloc)
-        conn.putrequest( "POST", purl.path )
-        conn.putheader( "Content-Type", "application/json" )
-        conn.putheader( "Content-Length", str(len(data)) )
-        if self.cookie:
-            conn.putheader( "Cookie", self.cookie )
-        conn.endheaders()
-        conn.send( data )
-        resp = conn.getresponse()
+        if self.wire == "msgpack":
+            content_type = codec.MSGPACK_MIMETYPE
+        else:
+            content_type = "application/json"
+
+        status, reason, body, cookies, ctype = self.post( self.routerurl, data, timeout, content_type )
 
-        if resp.status != 200:
-            raise RequestError( resp.status, resp.reason )
+        if status != 200:
+            raise RequestError( status, reason )
 
-        respdata = json.loads( resp.read() )
+        if ctype.startswith( codec.MSGPACK_MIMETYPE ):
+            respdata = codec.unpackb( body )
+        else:
+            respdata = json.loads( body )
         if respdata['type'] == 'exception':
             raise ReturnedError( respdata['message'], respdata['where'] )
         if respdata['tid'] != reqtid:
             raise RequestError( 'TID mismatch' )
 
-        cookie = resp.getheader( "set-cookie" )
-        if cookie:
-            self.cookie = cookie.split(';')[0]
+        self.update_cookies( cookies )
 
-        conn.close()
         return respdata['result']
 
     def get_object( self, action ):
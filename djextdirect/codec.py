@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+# MessagePack wire format, used by the router and the client if the msgpack
+# package is installed.
+#
+# Datetimes, dates, times and Decimals are transferred as extension types
+# that contain their ISO 8601 / string representation, so that they arrive
+# as the same type on the other side.
+#
+# Byte strings are sent as MessagePack str if they contain UTF-8, so that the
+# other side gets text for keys and values that are plain str in Python 2.
+# To send bytes as MessagePack bin, wrap them in Binary.
+#
+# This module does not depend on Django, so that the client can use it.
+
+import re
+import datetime
+from decimal import Decimal
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+EXT_DATETIME = 1
+EXT_DATE     = 2
+EXT_TIME     = 3
+EXT_DECIMAL  = 4
+
+TIME_RE = re.compile( r'^(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?([+-]\d{2}:\d{2})?$' )
+
+
+class FixedOffset( datetime.tzinfo ):
+    """ Time zone with a fixed offset from UTC in minutes. """
+
+    def __init__( self, minutes ):
+        self.offset = datetime.timedelta( minutes=minutes )
+
+    def utcoffset( self, dt ):
+        return self.offset
+
+    def dst( self, dt ):
+        return datetime.timedelta(0)
+
+    def tzname( self, dt ):
+        return None
+
+
+class Binary( str ):
+    """ Byte string that is sent as MessagePack bin instead of str. """
+    pass
+
+
+def available():
+    """ Check if the msgpack package is installed. """
+    return msgpack is not None
+
+
+def parse_time( value ):
+    """ Parse the output of time.isoformat(). """
+    match = TIME_RE.match( value )
+    if match is None:
+        raise ValueError( "invalid time: %r" % value )
+    hour, minute, second, fraction, offset = match.groups()
+    tzinfo = None
+    if offset is not None:
+        minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        tzinfo = FixedOffset( offset[0] == "-" and -minutes or minutes )
+    return datetime.time( int(hour), int(minute), int(second), int( ( fraction or "0" ).ljust(6, "0") ), tzinfo )
+
+
+def _default( obj ):
+    if isinstance( obj, datetime.datetime ):
+        return msgpack.ExtType( EXT_DATETIME, obj.isoformat().encode("ascii") )
+    if isinstance( obj, datetime.date ):
+        return msgpack.ExtType( EXT_DATE, obj.isoformat().encode("ascii") )
+    if isinstance( obj, datetime.time ):
+        return msgpack.ExtType( EXT_TIME, obj.isoformat().encode("ascii") )
+    if isinstance( obj, Decimal ):
+        return msgpack.ExtType( EXT_DECIMAL, str(obj) )
+    raise TypeError( "%r is not MessagePack serializable" % obj )
+
+
+def _ext_hook( code, data ):
+    if code == EXT_DATETIME:
+        datepart, timepart = data.split("T")
+        date = datetime.datetime.strptime( datepart, "%Y-%m-%d" ).date()
+        return datetime.datetime.combine( date, parse_time( timepart ) )
+    if code == EXT_DATE:
+        return datetime.datetime.strptime( data, "%Y-%m-%d" ).date()
+    if code == EXT_TIME:
+        return parse_time( data )
+    if code == EXT_DECIMAL:
+        return Decimal( data )
+    return msgpack.ExtType( code, data )
+
+
+def _text( obj ):
+    """ Convert byte strings in obj to unicode, except for Binary instances
+        and strings that aren't valid UTF-8.
+    """
+    if isinstance( obj, dict ):
+        return dict([ ( _text(key), _text(value) ) for key, value in obj.iteritems() ])
+    if isinstance( obj, ( list, tuple ) ):
+        return [ _text(value) for value in obj ]
+    if type(obj) is str:
+        try:
+            return obj.decode("utf-8")
+        except UnicodeDecodeError:
+            return obj
+    return obj
+
+
+def packb( data ):
+    """ Encode data to MessagePack. """
+    return msgpack.packb( _text( data ), default=_default, use_bin_type=True )
+
+
+def unpackb( data ):
+    """ Decode MessagePack data. Raises ValueError if data is malformed. """
+    try:
+        return msgpack.unpackb( data, ext_hook=_ext_hook, raw=False )
+    except ValueError:
+        raise
+    except Exception, err:
+        # msgpack and the extension types raise all kinds of errors, e.g.
+        # decimal.InvalidOperation for a malformed Decimal.
+        raise ValueError( "malformed MessagePack data: %s" % err )
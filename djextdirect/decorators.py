@@ -1,8 +1,9 @@
 # coding=utf-8
 from functools import wraps
-import json
 from django.http import Http404
 
+from auth import get_payload, get_credentials, authenticate_cached, authenticate_signed
+
 
 def require_authorization(func):
     @wraps(func)
@@ -11,17 +12,22 @@ def require_authorization(func):
         if request.user and request.user.is_authenticated():
             return func(request, *args, **kwargs)
 
+        # Auth by a request signed with an API key, without creating a session
+        user = authenticate_signed(request)
+        if user:
+            request.user = user
+            return func(request, *args, **kwargs)
+
         # Try to auth by username and password from request.body
         try:
-            rawjson = json.loads(request.body)
+            rawjson = get_payload(request)
         except ValueError:
             raise Http404("Invalid request")
 
-        username = rawjson.get('username', None)
-        password = rawjson.get('password', None)
+        username, password = get_credentials(rawjson)
         if username and password:
-            from django.contrib.auth import authenticate, login
-            user = authenticate(username=username, password=password)
+            from django.contrib.auth import login
+            user = authenticate_cached(username, password)
             if user:
                 login(request, user)
 
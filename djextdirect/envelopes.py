@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import json
+import traceback
+from sys import stderr
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+import codec
+
+
+def format_error( err ):
+    """ Return a tuple of (message, where) describing the exception currently
+        being handled.
+
+        In DEBUG mode, the traceback is formatted once, printed to stderr and
+        returned as "where", cut down to the last EXTDIRECT_TRACEBACK_LIMIT
+        characters (default 4000). Otherwise, no details are disclosed.
+    """
+    if not settings.DEBUG:
+        return 'The socket packet pocket has an error to report.', ''
+    tb = traceback.format_exc()
+    stderr.write( tb )
+    limit = getattr( settings, "EXTDIRECT_TRACEBACK_LIMIT", 4000 )
+    if limit and len(tb) > limit:
+        tb = "...\n" + tb[-limit:]
+    return err.message, tb
+
+
+class JSONEnvelopes( object ):
+    """ Builds the JSON encoded Ext.Direct response envelopes.
+
+        Instead of building a dict for every response and encoding it as a
+        whole, only the result is encoded and spliced into the envelope, the
+        parts of which are encoded once per action and method and cached.
+        Exceptions for the same message and location (e.g. when a client
+        keeps calling a method that does not exist) are cached as well.
+    """
+
+    mimetype = "application/json"
+
+    # Upper bound for the number of cached envelope parts.
+    CACHE_SIZE = 1000
+
+    def __init__( self ):
+        self.prefixes = {}
+        self.errors   = {}
+
+    def encode( self, data ):
+        return json.dumps( data, cls=DjangoJSONEncoder )
+
+    def _cached( self, cache, key, build ):
+        try:
+            return cache[key]
+        except KeyError:
+            if len(cache) >= self.CACHE_SIZE:
+                cache.clear()
+            cache[key] = value = build()
+            return value
+
+    def result( self, rtype, tid, action, method, result, extra=None ):
+        """ Return the envelope for a successful call. """
+        prefix = self._cached( self.prefixes, ( rtype, action, method ), lambda: '{"type": %s, "action": %s, "method": %s, "tid": ' % (
+            self.encode( rtype ), self.encode( action ), self.encode( method ) ) )
+        if extra:
+            return '%s%s, %s, "result": %s}' % ( prefix, self.encode( tid ), self.encode( extra )[1:-1], self.encode( result ) )
+        return '%s%s, "result": %s}' % ( prefix, self.encode( tid ), self.encode( result ) )
+
+    def exception( self, tid, message, where, extra=None, cache=False ):
+        """ Return the envelope for an exception.
+
+            If cache is True, the encoded message and location are cached,
+            which should only be used for errors that do not contain any
+            user-provided data other than action and method names.
+        """
+        if cache:
+            suffix = self._cached( self.errors, ( message, where ), lambda: '"message": %s, "where": %s}' % (
+                self.encode( message ), self.encode( where ) ) )
+        else:
+            suffix = '"message": %s, "where": %s}' % ( self.encode( message ), self.encode( where ) )
+        if extra:
+            return '{"type": "exception", "tid": %s, %s, %s' % ( self.encode( tid ), self.encode( extra )[1:-1], suffix )
+        return '{"type": "exception", "tid": %s, %s' % ( self.encode( tid ), suffix )
+
+    def batch( self, responses ):
+        """ Return the response body for the given list of envelopes. """
+        if len(responses) == 1:
+            return responses[0]
+        return "[" + ", ".join( responses ) + "]"
+
+
+class MsgpackEnvelopes( object ):
+    """ Builds MessagePack encoded Ext.Direct response envelopes, see codec. """
+
+    mimetype = codec.MSGPACK_MIMETYPE
+
+    def result( self, rtype, tid, action, method, result, extra=None ):
+        response = {
+            "type":   rtype,
+            "tid":    tid,
+            "action": action,
+            "method": method,
+            "result": result
+            }
+        if extra:
+            response.update( extra )
+        return response
+
+    def exception( self, tid, message, where, extra=None, cache=False ):
+        response = {
+            'type':    'exception',
+            'message': message,
+            'where':   where,
+            "tid":     tid,
+            }
+        if extra:
+            response.update( extra )
+        return response
+
+    def batch( self, responses ):
+        if len(responses) == 1:
+            return codec.packb( responses[0] )
+        return codec.packb( responses )
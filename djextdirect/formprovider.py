@@ -20,9 +20,13 @@ import json
 import functools
 
 from django      import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.http import HttpResponse, Http404
 from django.conf.urls import url
 from django.utils.safestring import mark_safe
+from django.core.urlresolvers  import reverse
 from django.core.serializers.json import DjangoJSONEncoder
 
 from provider import Provider
@@ -98,6 +102,13 @@ Ext.extend( Ext.ux.%(clsname)s, Ext.form.FormPanel, {
             }
         });
     },
+    validateValues: function( values ){
+        this.api.validate( typeof this.pk != "undefined" ? this.pk : -1, values, function( result ){
+            if( result && !result.success ){
+                this.getForm().markInvalid( result.errors );
+            }
+        }, this );
+    },
 } );
 
 Ext.reg( '%(clslowername)s', Ext.ux.%(clsname)s );
@@ -171,10 +182,20 @@ class FormProvider(Provider):
         request as parameter before calling is_valid() or save(). If EXT_validate
         returns False, the form will not be saved and an error will be returned
         instead. EXT_validate should update form.errors before returning False.
+
+        Single fields can be validated without submitting the whole form by
+        calling the form's validateValues method with a dict of the changed
+        values, which calls the validate method on the server. It only runs
+        the clean() method of the given fields and the form's clean_<field>
+        methods, but not the form's clean(), EXT_validate or model validation,
+        and does not save anything. The instance is cached for
+        EXTDIRECT_FORM_CACHE_TIMEOUT seconds (default 10, 0 disables the
+        cache) so that repeated validation does not hit the database; the
+        cache entry is dropped when the form is submitted.
     """
 
-    def __init__( self, name="Ext.app.REMOTING_API", autoadd=True ):
-        Provider.__init__( self, name="Ext.app.REMOTING_API", autoadd=True )
+    def __init__( self, name="Ext.app.REMOTING_API", autoadd=True, **kwargs ):
+        Provider.__init__( self, name=name, autoadd=autoadd, **kwargs )
         self.forms    = {}
 
     def get_choices_combo_src( self, request ):
@@ -187,27 +208,31 @@ class FormProvider(Provider):
 
         formname = formclass.__name__.lower()
         self.forms[formname] = formclass
+        self._urls = None
 
         getfunc = functools.partial( self.get_form_data, formname )
-        getfunc.EXT_len = 1
         getfunc.EXT_argnames = ["pk"]
         getfunc.EXT_flags = {}
 
         updatefunc = functools.partial( self.update_form_data, formname )
-        updatefunc.EXT_len = 1
         updatefunc.EXT_argnames = ["pk"]
         updatefunc.EXT_flags = { 'formHandler': True }
 
         choicesfunc = functools.partial( self.get_field_choices, formname )
-        choicesfunc.EXT_len = 2
         choicesfunc.EXT_argnames = ["pk", "field"]
         choicesfunc.EXT_flags = {}
 
+        validatefunc = functools.partial( self.validate_form_data, formname )
+        validatefunc.EXT_argnames = ["pk", "values"]
+        validatefunc.EXT_flags = {}
+
         self.classes["XD_%s" % formclass.__name__] = {
-            "get":     getfunc,
-            "update":  updatefunc,
-            "choices": choicesfunc,
+            "get":      getfunc,
+            "update":   updatefunc,
+            "choices":  choicesfunc,
+            "validate": validatefunc,
             }
+        self.generation += 1
 
         return formclass
 
@@ -217,6 +242,10 @@ class FormProvider(Provider):
         if formname not in self.forms:
             raise Http404(formname)
 
+        return HttpResponse( mark_safe( self.build_form_js( formname ) ), mimetype="text/javascript" )
+
+    def build_form_js( self, formname ):
+        """ Return the ExtJS FormPanel class definition for the given form. """
         items = []
         clsname = self.forms[formname].__name__
         hasfiles = False
@@ -297,10 +326,28 @@ class FormProvider(Provider):
                 'load:  '  + ("XD_%s.get"     % clsname) + ","
                 'submit:'  + ("XD_%s.update"  % clsname) + ","
                 'choices:' + ("XD_%s.choices" % clsname) + ","
+                'validate:' + ("XD_%s.validate" % clsname) + ","
                 "}"),
             }
 
-        return HttpResponse( mark_safe( clscode ), mimetype="text/javascript" )
+        return clscode
+
+    def build_scripts( self ):
+        scripts = Provider.build_scripts( self )
+        if self.forms:
+            scripts["choicescombo.js"] = EXT_DYNAMICCHOICES_COMBO
+            for formname in self.forms:
+                scripts["%s.js" % formname] = self.build_form_js( formname )
+        return scripts
+
+    def script_url( self, name ):
+        if self.bundle is not None and name in self.bundle:
+            return Provider.script_url( self, name )
+        if name == "choicescombo.js":
+            return reverse( self.get_choices_combo_src )
+        if name.endswith(".js") and name[:-3] in self.forms:
+            return reverse( self.get_form, kwargs={"formname": name[:-3]} )
+        return Provider.script_url( self, name )
 
     def get_field_choices( self, formname, request, pk, field ):
         """ Create a bound instance of the form and return choices from the given field. """
@@ -360,6 +407,8 @@ class FormProvider(Provider):
 
         if forminst.is_valid():
             forminst.save()
+            if pk != -1:
+                cache.delete( self.get_instance_cache_key( formcls, pk ) )
             return { 'success': True }
         else:
             errdict = {}
@@ -367,6 +416,56 @@ class FormProvider(Provider):
                 errdict[errfld] = "\n".join( forminst.errors[errfld] )
             return { 'success': False, 'errors': errdict }
 
+    def get_instance_cache_key( self, formcls, pk ):
+        meta = formcls.Meta.model._meta
+        return "djextdirect:form:%s.%s:%s" % ( meta.app_label, meta.object_name, pk )
+
+    def get_cached_instance( self, formcls, pk ):
+        """ Return the model instance with the given pk, cached for
+            EXTDIRECT_FORM_CACHE_TIMEOUT seconds.
+        """
+        timeout = getattr( settings, "EXTDIRECT_FORM_CACHE_TIMEOUT", 10 )
+        if not timeout:
+            return formcls.Meta.model.objects.get( pk=pk )
+        key = self.get_instance_cache_key( formcls, pk )
+        instance = cache.get( key )
+        if instance is None:
+            instance = formcls.Meta.model.objects.get( pk=pk )
+            cache.set( key, instance, timeout )
+        return instance
+
+    def validate_form_data( self, formname, request, pk, values ):
+        """ Called to validate the given field values without saving them. """
+        formcls  = self.forms[formname]
+        if pk != -1:
+            instance = self.get_cached_instance( formcls, pk )
+        else:
+            instance = None
+        forminst = formcls( instance=instance )
+
+        if hasattr( forminst, "EXT_authorize" ) and \
+           forminst.EXT_authorize( request, "validate" ) is False:
+            return { 'success': False, 'errors': {'__all__': 'access denied'} }
+
+        # clean_<field> methods expect the cleaned values in cleaned_data
+        forminst.cleaned_data = {}
+        errdict = {}
+        for fldname, value in values.items():
+            if fldname not in forminst.fields:
+                errdict[fldname] = "unknown field"
+                continue
+            field = forminst.fields[fldname]
+            if isinstance( field, forms.FileField ):
+                continue
+            try:
+                forminst.cleaned_data[fldname] = field.clean( value )
+                if hasattr( forminst, "clean_%s" % fldname ):
+                    forminst.cleaned_data[fldname] = getattr( forminst, "clean_%s" % fldname )()
+            except ValidationError, err:
+                errdict[fldname] = "\n".join( err.messages )
+
+        return { 'success': not errdict, 'errors': errdict }
+
     def get_urls(self):
         """ Return the URL patterns. """
         pat = Provider.get_urls(self)
@@ -374,5 +473,3 @@ class FormProvider(Provider):
             pat.append( url( r'choicescombo.js$',      self.get_choices_combo_src ) )
             pat.append( url( r'(?P<formname>\w+).js$', self.get_form ) )
         return pat
-
-    urls = property(get_urls)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+class QueryStats( object ):
+    """ Number, time and duplicates of the queries made during a call. """
+
+    def __init__( self ):
+        self.count      = 0
+        self.time       = 0.0
+        self.duplicates = 0
+        self.seen       = set()
+
+    def record( self, sql, duration ):
+        """ Record a query that took duration seconds. """
+        self.count += 1
+        self.time  += duration
+        if sql in self.seen:
+            self.duplicates += 1
+        else:
+            self.seen.add( sql )
+
+    def as_dict( self ):
+        return {
+            "queries":    self.count,
+            "db_time":    round( self.time * 1000, 3 ),
+            "duplicates": self.duplicates,
+            }
+
+
+@contextmanager
+def _wrap_executes( conns, wrappers ):
+    """ Install the given execute wrappers on the respective connections. """
+    if not conns:
+        yield
+        return
+    with conns[0].execute_wrapper( wrappers[0] ):
+        with _wrap_executes( conns[1:], wrappers[1:] ):
+            yield
+
+
+@contextmanager
+def count_queries( enabled=True, using=None ):
+    """ Count the queries made within the block, and yield a QueryStats
+        instance (or None if not enabled).
+
+        If using is None, queries on all configured databases are counted
+        (including replicas that reads may be routed to, see transactions),
+        otherwise only those on the database with the given alias.
+
+        Queries are considered duplicates if they have the same SQL and the
+        same parameters and run on the same database, which usually points to
+        an N+1 query problem.
+
+        On Django versions that support connection.execute_wrapper, queries are
+        intercepted directly. Otherwise, the connections are switched to the
+        debug cursor for the duration of the block and connection.queries is
+        evaluated afterwards.
+    """
+    if not enabled:
+        yield None
+        return
+
+    stats = QueryStats()
+    if using is None:
+        aliases = list( connections )
+    else:
+        aliases = [ using ]
+    conns = [ connections[alias] for alias in aliases ]
+
+    if hasattr( conns[0], "execute_wrapper" ):
+        def make_wrapper( alias ):
+            def wrapper( execute, sql, params, many, context ):
+                started = time.time()
+                try:
+                    return execute( sql, params, many, context )
+                finally:
+                    stats.record( "%s: %s %r" % ( alias, sql, params ), time.time() - started )
+            return wrapper
+
+        with _wrap_executes( conns, [ make_wrapper( alias ) for alias in aliases ] ):
+            yield stats
+
+    else:
+        debugcursors = [ conn.use_debug_cursor for conn in conns ]
+        starts = []
+        for conn in conns:
+            conn.use_debug_cursor = True
+            starts.append( len( conn.queries ) )
+        try:
+            yield stats
+        finally:
+            for alias, conn, start, debugcursor in zip( aliases, conns, starts, debugcursors ):
+                for query in list( conn.queries )[start:]:
+                    stats.record( "%s: %s" % ( alias, query["sql"] ), float( query["time"] ) )
+                conn.use_debug_cursor = debugcursor
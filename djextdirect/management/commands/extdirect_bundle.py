@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import json
+import hashlib
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.importlib import import_module
+
+
+def minify( name, source ):
+    """ Strip indentation and empty lines from javascript, and whitespace from JSON.
+
+        Line breaks are kept, so this is safe for code that relies on automatic
+        semicolon insertion.
+    """
+    if name.endswith(".json"):
+        return json.dumps( json.loads( source ), separators=(',', ':') )
+    lines = [ line.strip() for line in source.split("\n") ]
+    return "\n".join([ line for line in lines if line ])
+
+
+class Command( BaseCommand ):
+    """ Render the API description and form scripts of a Provider to static files.
+
+        Usage:
+
+            ./manage.py extdirect_bundle myapp.views.EXT_JS_PROVIDER /srv/static/extdirect
+
+        The command is available if djextdirect is in INSTALLED_APPS.
+
+        Every script is written to a file whose name contains a hash of its
+        content, and a manifest.json is written that maps the script names to
+        those files. Pass the manifest to Provider.load_bundle to make the
+        Provider reference the static files. Note that pages using the bundle
+        need to set the CSRF cookie themselves (see Provider.load_bundle).
+    """
+
+    args = '<provider> <directory>'
+    help = 'Render api.js, api.json and form scripts of an Ext.Direct Provider to static files.'
+
+    option_list = BaseCommand.option_list + (
+        make_option( '--no-minify', action='store_false', dest='minify', default=True,
+            help='Do not minify the rendered scripts.' ),
+        )
+
+    def handle( self, *args, **options ):
+        if len(args) != 2:
+            raise CommandError( "Usage: extdirect_bundle %s" % self.args )
+
+        provpath, outdir = args
+        modname, _, attrname = provpath.rpartition(".")
+        try:
+            provider = getattr( import_module( modname ), attrname )
+        except (ImportError, AttributeError, ValueError), err:
+            raise CommandError( "Cannot import provider '%s': %s" % ( provpath, err ) )
+
+        if not os.path.isdir( outdir ):
+            os.makedirs( outdir )
+
+        manifest = {}
+        scripts  = provider.build_scripts()
+        for name in sorted( scripts ):
+            source = scripts[name]
+            if isinstance( source, unicode ):
+                source = source.encode("utf-8")
+            if options["minify"]:
+                source = minify( name, source )
+
+            base, ext = os.path.splitext( name )
+            filename = "%s.%s%s" % ( base, hashlib.md5( source ).hexdigest()[:12], ext )
+            outfile = open( os.path.join( outdir, filename ), "wb" )
+            try:
+                outfile.write( source )
+            finally:
+                outfile.close()
+            manifest[name] = filename
+            self.stdout.write( "%s -> %s" % ( name, filename ) )
+
+        outfile = open( os.path.join( outdir, "manifest.json" ), "wb" )
+        try:
+            json.dump( manifest, outfile, indent=4, sort_keys=True )
+        finally:
+            outfile.close()
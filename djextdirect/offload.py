@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import multiprocessing
+from threading import Lock
+
+# Database connections inherited from the parent process. They are kept
+# referenced so that they are never closed (and thereby torn down for the
+# parent as well) by the worker processes.
+_inherited = []
+
+
+def _init_worker():
+    """ Make Django open new database connections in the worker process. """
+    from django.db import connections
+    for conn in connections.all():
+        _inherited.append( conn.connection )
+        conn.connection = None
+
+
+def _run_offloaded( func, context, args ):
+    """ Called in the worker process to run func. """
+    return func( context, *args )
+
+
+class RequestContext( object ):
+    """ Picklable stand-in for the request that is passed to offloaded methods.
+
+        It carries the user id, session key, GET parameters, language and a
+        subset of the META dict. The user is loaded from the database on first
+        access of the user attribute.
+    """
+
+    META_KEYS = ( "REMOTE_ADDR", "REMOTE_HOST", "SERVER_NAME", "SERVER_PORT", "PATH_INFO",
+                  "HTTP_HOST", "HTTP_USER_AGENT", "HTTP_ACCEPT_LANGUAGE", "HTTP_REFERER" )
+
+    def __init__( self, request ):
+        user = getattr( request, "user", None )
+        if user is not None and user.is_authenticated():
+            self.user_id = user.pk
+        else:
+            self.user_id = None
+        session = getattr( request, "session", None )
+        if session is not None:
+            self.session_key = session.session_key
+        else:
+            self.session_key = None
+        self.GET  = dict( request.GET.items() )
+        self.META = dict([ ( key, request.META[key] ) for key in self.META_KEYS if key in request.META ])
+        self.LANGUAGE_CODE = getattr( request, "LANGUAGE_CODE", None )
+        self._user = None
+
+    def __getstate__( self ):
+        state = self.__dict__.copy()
+        state["_user"] = None
+        return state
+
+    @property
+    def user( self ):
+        if self._user is None:
+            from django.contrib.auth import get_user_model
+            from django.contrib.auth.models import AnonymousUser
+            if self.user_id is None:
+                self._user = AnonymousUser()
+            else:
+                self._user = get_user_model().objects.get( pk=self.user_id )
+        return self._user
+
+
+class OffloadPool( object ):
+    """ Runs remote methods in a pool of worker processes.
+
+        Methods are registered for offloading like so:
+
+        >>> @EXT_JS_PROVIDER.register_method( "Reports", offload=True )
+        ... def render_pdf( request, report_id ):
+        ...    return base64.b64encode( render( report_id ) )
+
+        Offloaded methods get a RequestContext instead of the request, and their
+        arguments and result are pickled to be passed between processes. The
+        method itself is pickled by reference, so it has to be a module level
+        function that is importable under its own name.
+
+        The pool is started on first use. Since forking a process in which other
+        threads hold locks is not safe, call start() while the web worker boots
+        if you are using a threaded server.
+    """
+
+    def __init__( self, processes=None, timeout=None ):
+        self.processes = processes
+        self.timeout   = timeout
+        self.pool      = None
+        self.lock      = Lock()
+
+    def start( self ):
+        """ Start the worker processes if they are not running yet. """
+        self.lock.acquire()
+        try:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool( self.processes, initializer=_init_worker )
+        finally:
+            self.lock.release()
+        return self.pool
+
+    def apply( self, func, request, args ):
+        """ Call func in a worker process and wait for its result.
+
+            Exceptions raised by func are re-raised, a multiprocessing.TimeoutError
+            is raised if the result is not available after timeout seconds.
+        """
+        pool = self.pool or self.start()
+        result = pool.apply_async( _run_offloaded, ( func, RequestContext( request ), list(args) ) )
+        return result.get( self.timeout )
+
+    def close( self ):
+        """ Stop the worker processes. """
+        self.lock.acquire()
+        try:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        finally:
+            self.lock.release()
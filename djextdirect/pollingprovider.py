@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import json
+import time
+import uuid
+import traceback
+from sys import stderr
+from threading import Condition
+from collections import deque
+
+from django.http import HttpResponse
+from django.conf import settings
+from django.conf.urls import patterns
+from django.core.urlresolvers  import reverse
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Name of the poll parameter and event that carry the client's event cursor.
+CURSOR_NAME = "EXT_poll_seq"
+
+
+class PollingProvider( object ):
+    """ Polling Provider for Ext.Direct. This class serves Ext.Direct "event"
+        responses to clients that poll the server, either by plain polling or
+        by long-polling.
+
+        Instantiation:
+
+        >>> EXT_JS_POLLER = PollingProvider( [name="Ext.app.POLLING_API", autoadd=True, interval=3000, timeout=25] )
+
+        There are two ways to produce events. Event sources are functions that
+        get called on every poll with the request as their only parameter, and
+        return either the event data or None if there is nothing to report:
+
+        >>> @EXT_JS_POLLER.register_event("mailcount")
+        ... def mailcount( request ):
+        ...    return Mail.objects.filter( owner=request.user, unread=True ).count()
+
+        Alternatively, any part of your code can publish an event which will be
+        delivered to every client that is currently waiting or polls next:
+
+        >>> EXT_JS_POLLER.publish( "newmail", {"subject": "hi there"} )
+
+        If timeout is greater than zero and neither event sources nor published
+        events have anything to deliver, the poll request blocks for up to
+        timeout seconds waiting for a published event (long-polling). All
+        waiting clients are woken up at once when an event is published. Note
+        that published events only fan out to clients served by the same
+        process, so use a threaded server for long-polling and set timeout to 0
+        for prefork deployments.
+
+        Published events are kept in a ring buffer of the given backlog size.
+        Whenever it changes, the sequence number of the last event a client has
+        seen is sent to the client as an "EXT_poll_seq" event, and the api.js
+        makes the client send it back with its next poll (as a parameter of the
+        same name), so clients do not miss events published between two polls.
+        The cursor is kept by every client (e.g. every browser tab) separately,
+        the session is not used. Sequence numbers are tagged with an ID that is
+        unique to the PollingProvider instance, so a client whose poll is
+        served by another process (or by the same one after a restart) starts
+        over at that process' current sequence number.
+
+        If you set autoadd to False and add the provider yourself, do the same
+        as the api.js does:
+
+            Ext.Direct.addProvider( Ext.app.POLLING_API ).on( "data", function( provider, event ){
+                if( event.name == "EXT_poll_seq" )
+                    provider.baseParams = Ext.apply( provider.baseParams || {}, { EXT_poll_seq: event.data } );
+            });
+
+        Include the Provider's URLs the same way as for the Provider, which
+        will define the URLs "api.js", "api.json" and "poll". The api.js
+        will contain something like::
+
+            Ext.app.POLLING_API = {
+                "url": "/mumble/events/poll",
+                "type": "polling",
+                "interval": 3000
+                }
+
+        In ExtJS, listen for events on the provider or on Ext.Direct:
+
+            Ext.Direct.on( "mailcount", function(event){ ... } );
+    """
+
+    def __init__( self, name="Ext.app.POLLING_API", autoadd=True, interval=3000, timeout=25, backlog=100 ):
+        self.name     = name
+        self.autoadd  = autoadd
+        self.interval = interval
+        self.timeout  = timeout
+        self.sources  = {}
+        self.events   = deque( maxlen=backlog )
+        self._seq     = 0
+        self.bootid   = uuid.uuid4().hex
+        self._cond    = Condition()
+        self._urls    = None
+
+    def register_event( self, name ):
+        """ Return a function that takes an event source as an argument and
+            registers it for the given event name.
+
+            Note: This decorator does not replace the function by a new function,
+            it returns the original function as-is.
+        """
+        def _register_event( source ):
+            self.sources[name] = source
+            return source
+        return _register_event
+
+    def publish( self, name, data=None ):
+        """ Publish an event and wake up all clients waiting for events. """
+        self._cond.acquire()
+        try:
+            self._seq += 1
+            self.events.append( ( self._seq, name, data ) )
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def get_published( self, since ):
+        """ Return the current sequence number and all published events newer than since. """
+        self._cond.acquire()
+        try:
+            return self._seq, [ {"type": "event", "name": name, "data": data}
+                                for (seq, name, data) in self.events if seq > since ]
+        finally:
+            self._cond.release()
+
+    def wait_published( self, since, timeout ):
+        """ Wait up to timeout seconds for an event newer than since to be published. """
+        deadline = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while self._seq <= since:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait( remaining )
+        finally:
+            self._cond.release()
+        return self.get_published( since )
+
+    def get_source_events( self, request ):
+        """ Call all registered event sources and return events for those that have data. """
+        events = []
+        for name in self.sources:
+            try:
+                data = self.sources[name]( request )
+            except Exception, err:
+                if settings.DEBUG:
+                    traceback.print_exc( file=stderr )
+                    events.append({
+                        'type':    'exception',
+                        'message': err.message,
+                        'where':   name,
+                        })
+                continue
+            if data is not None:
+                events.append({ "type": "event", "name": name, "data": data })
+        return events
+
+    def build_api_dict( self ):
+        return {
+            "url":      reverse( self.poll ),
+            "type":     "polling",
+            "interval": self.interval,
+            }
+
+    def get_api_plain( self, request ):
+        """ Get a JSON description of the polling API. """
+        return HttpResponse( json.dumps( self.build_api_dict(), cls=DjangoJSONEncoder ),
+                             mimetype="application/json" )
+
+    def get_api( self, request ):
+        """ Get a javascript description of the polling API that is meant to be
+            embedded directly into the web site.
+        """
+        lines = ["%s = %s;" % ( self.name, json.dumps( self.build_api_dict(), cls=DjangoJSONEncoder ) )]
+        if self.autoadd:
+            lines.append( "Ext.Direct.addProvider( %s ).on( \"data\", function( provider, event ){" % self.name )
+            lines.append( "    if( event.name == \"%s\" )" % CURSOR_NAME )
+            lines.append( "        provider.baseParams = Ext.apply( provider.baseParams || {}, { %s: event.data } );" % CURSOR_NAME )
+            lines.append( "});" )
+        return HttpResponse( "\n".join( lines ), mimetype="text/javascript" )
+
+    def poll( self, request ):
+        """ Implements the polling part of the Ext.Direct specification. """
+        cursor = request.POST.get( CURSOR_NAME ) or request.GET.get( CURSOR_NAME )
+        since  = self._seq
+        if cursor:
+            bootid, _, seq = cursor.partition( ":" )
+            if bootid == self.bootid and seq.isdigit():
+                since = min( int(seq), self._seq )
+
+        events = self.get_source_events( request )
+        seq, published = self.get_published( since )
+        if not events and not published and self.timeout > 0:
+            seq, published = self.wait_published( since, self.timeout )
+        events.extend( published )
+
+        newcursor = "%s:%d" % ( self.bootid, seq )
+        if cursor != newcursor:
+            events.append({ "type": "event", "name": CURSOR_NAME, "data": newcursor })
+
+        return HttpResponse( json.dumps( events, cls=DjangoJSONEncoder ), mimetype="application/json" )
+
+    def get_urls(self):
+        """ Return the URL patterns. """
+        pat =  patterns('',
+            (r'api.json$', self.get_api_plain ),
+            (r'api.js$',   self.get_api ),
+            (r'poll/?',    self.poll ),
+            )
+        return pat
+
+    @property
+    def urls(self):
+        """ The URL patterns, built on first access. """
+        if self._urls is None:
+            self._urls = self.get_urls()
+        return self._urls
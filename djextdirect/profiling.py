@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import time
+import random
+import marshal
+import cProfile
+from threading import Lock
+from collections import deque
+
+
+def should_profile( request, rate ):
+    """ Check if the request should be profiled: either because a staff user
+        asked for it by sending the X-ExtDirect-Profile header, or because it
+        has been picked at the given sampling rate (0.0 - 1.0).
+    """
+    if request.META.get("HTTP_X_EXTDIRECT_PROFILE"):
+        user = getattr( request, "user", None )
+        if user is not None and user.is_authenticated() and user.is_staff:
+            return True
+    return rate > 0 and random.random() < rate
+
+
+def funclabel( func ):
+    """ Return a readable label for a pstats function key. """
+    filename, lineno, funcname = func
+    if filename == "~":
+        return funcname
+    return "%s:%d(%s)" % ( filename, lineno, funcname )
+
+
+class ProfileBuffer( object ):
+    """ Keeps the profiles of the last size profiled requests. """
+
+    def __init__( self, size=20 ):
+        self.profiles = deque( maxlen=size )
+        self.lock     = Lock()
+        self.lastid   = 0
+
+    def run( self, calls, func, *args ):
+        """ Run func under cProfile, store the profile and return func's result.
+
+            calls is a list of "action.method" strings describing the request.
+        """
+        profiler = cProfile.Profile()
+        started  = time.time()
+        try:
+            return profiler.runcall( func, *args )
+        finally:
+            elapsed = time.time() - started
+            profiler.create_stats()
+            self.lock.acquire()
+            try:
+                self.lastid += 1
+                self.profiles.append({
+                    "id":      self.lastid,
+                    "time":    started,
+                    "elapsed": elapsed,
+                    "calls":   calls,
+                    "stats":   profiler.stats,
+                    })
+            finally:
+                self.lock.release()
+
+    def list( self ):
+        """ Return a list describing the stored profiles, newest first. """
+        self.lock.acquire()
+        try:
+            return [ dict([ ( key, prof[key] ) for key in ("id", "time", "elapsed", "calls") ])
+                     for prof in reversed( self.profiles ) ]
+        finally:
+            self.lock.release()
+
+    def get( self, profid ):
+        """ Return the stats of the given profile, or None if it is not in the buffer anymore. """
+        self.lock.acquire()
+        try:
+            for prof in self.profiles:
+                if prof["id"] == profid:
+                    return prof["stats"]
+            return None
+        finally:
+            self.lock.release()
+
+    def dump_pstats( self, stats ):
+        """ Return stats in the format written by pstats.Stats.dump_stats. """
+        return marshal.dumps( stats )
+
+    def dump_collapsed( self, stats ):
+        """ Return stats as collapsed stacks that can be fed to flamegraph.pl.
+
+            cProfile only records the immediate caller of every function, so
+            each line is a caller;callee pair weighted by the time spent in the
+            callee (in microseconds) when called from that caller.
+        """
+        lines = []
+        for func, ( cc, nc, tt, ct, callers ) in stats.iteritems():
+            if not callers:
+                lines.append( "%s %d" % ( funclabel(func), int( tt * 1000000 ) ) )
+            for caller, edge in callers.iteritems():
+                lines.append( "%s;%s %d" % ( funclabel(caller), funclabel(func), int( edge[2] * 1000000 ) ) )
+        return "\n".join( sorted( lines ) ) + "\n"
@@ -16,18 +16,28 @@
 """
 
 import json
+import time
 import inspect
 import functools
-import traceback
-from sys import stderr
+from urlparse import urljoin
 
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden, Http404
 from django.conf import settings
+from django.db import transaction
 from django.conf.urls import patterns
 from django.core.urlresolvers  import reverse
+from django.core.exceptions import ImproperlyConfigured
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.utils.datastructures import MultiValueDictKeyError
 from django.core.serializers.json import DjangoJSONEncoder
 
+from offload import OffloadPool
+from transactions import method_policy
+from instrumentation import count_queries
+from profiling import ProfileBuffer, should_profile
+from envelopes import JSONEnvelopes, MsgpackEnvelopes, format_error
+import codec
+
 
 def getname( cls_or_name ):
     """ If cls_or_name is not a string, return its __name__. """
@@ -35,6 +45,16 @@ def getname( cls_or_name ):
         return cls_or_name.__name__
     return cls_or_name
 
+def getargnames( func ):
+    """ Return the names of func's arguments (except for the request), which
+        are introspected on first use and then cached in func.EXT_argnames.
+    """
+    try:
+        return func.EXT_argnames
+    except AttributeError:
+        func.EXT_argnames = inspect.getargspec( func )[0][1:]
+        return func.EXT_argnames
+
 
 class Provider( object ):
     """ Provider for Ext.Direct. This class handles building API information and
@@ -71,6 +91,10 @@ class Provider( object ):
 
         This way, the Provider will define the URLs "api/api.js" and "api/router".
 
+        Alternatively, the scripts can be rendered into a static bundle using
+        the extdirect_bundle management command and be loaded from there, see
+        load_bundle and script_url.
+
         If you then access the "api/api.js" URL, you will get a response such as::
 
             Ext.app.REMOTING_API = { # Ext.app.REMOTING_API is from Provider.name
@@ -80,25 +104,95 @@ class Provider( object ):
                 }
 
         You can then use this code in ExtJS to define the Provider there.
+
+        The upload_handlers parameter takes a list of functions that get called
+        with the request and return a Django upload handler, e.g. a partial of
+        djextdirect.uploadhandler.StreamingUploadHandler. Those handlers are
+        installed for form requests before the request body is parsed, which
+        allows for streaming large uploads to disk instead of buffering them.
+        To make this possible, the router view is exempt from the CSRF
+        middleware and does the CSRF check itself after installing them.
+
+        Methods registered with offload=True are run in a pool of
+        offload_processes worker processes (default: one per CPU), which is
+        available as Provider.offload. If offload_timeout is given, calls that
+        take longer than that many seconds fail.
+
+        If batch_atomic is True, all calls of a batched request run in a single
+        transaction, with a savepoint for every call so that a failing call
+        only rolls back its own changes. Offloaded methods run in a separate
+        process and therefore are not part of that transaction.
+
+        If metrics is given, it is called after every call with the action,
+        method, elapsed time in seconds, the exception raised (or None) and
+        the query stats. If instrument is True, the number of queries, the time
+        spent in the database and the number of duplicate queries are recorded
+        for every call (see instrumentation.count_queries) and passed to the
+        metrics hook as a dict; in DEBUG mode, they are also added to the
+        response in a "debug" field.
+
+        Router requests can be profiled with cProfile: requests of staff users
+        that carry an X-ExtDirect-Profile header are always profiled, other
+        requests are picked at random at the given profile_rate (0.0 - 1.0).
+        The last profile_buffer profiles are kept in memory, and staff users
+        can list them under "profiles/" and download them as
+        "profiles/<id>.pstats" (for pstats) or "profiles/<id>.collapsed" (for
+        flamegraph.pl).
+
+        If the msgpack package is installed, the router also accepts requests
+        encoded in MessagePack (Content-Type: application/x-msgpack) and
+        answers them in MessagePack, as it does for clients that list that
+        type in their Accept header. Browsers keep getting JSON, as do form
+        submissions. Strings are sent as MessagePack str; methods that return
+        raw bytes can wrap them in codec.Binary to have them sent as bin.
     """
 
-    def __init__( self, name="Ext.app.REMOTING_API", autoadd=True ):
+    def __init__( self, name="Ext.app.REMOTING_API", autoadd=True, upload_handlers=None,
+                  offload_processes=None, offload_timeout=None, batch_atomic=False,
+                  instrument=False, metrics=None, profile_rate=0.0, profile_buffer=20 ):
         self.name     = name
         self.autoadd  = autoadd
         self.classes  = {}
-
-    def register_method( self, cls_or_name, flags=None ):
+        self.upload_handlers = upload_handlers or []
+        self.offload    = OffloadPool( offload_processes, offload_timeout )
+        self.batch_atomic = batch_atomic
+        self.instrument   = instrument
+        self.metrics      = metrics
+        self.profile_rate = profile_rate
+        self.profiles     = ProfileBuffer( profile_buffer )
+        self.envelopes    = JSONEnvelopes()
+        if codec.available():
+            self.msgpack_envelopes = MsgpackEnvelopes()
+        else:
+            self.msgpack_envelopes = None
+        self.bundle     = None
+        self.bundle_url = None
+        self._urls      = None
+        self._csrf_route = csrf_protect( self.route )
+        # Incremented whenever methods are registered, see ProviderGroup.
+        self.generation = 0
+
+    def register_method( self, cls_or_name, flags=None, **options ):
         """ Return a function that takes a method as an argument and adds that
             to cls_or_name.
 
             The flags parameter is for additional information, e.g. formHandler=True.
+            Flags are exported to the client in the API description.
+
+            Further keyword arguments are server side options which are stored
+            in method.EXT_options and not exported:
+
+            offload: Run the method in a worker process, see offload.OffloadPool.
+            atomic:  Run the method in a transaction.
+            replica: Route the method's reads to a replica database, see
+                     transactions.ReplicaRouter.
 
             Note: This decorator does not replace the method by a new function,
             it returns the original function as-is.
         """
-        return functools.partial( self._register_method, cls_or_name, flags=flags )
+        return functools.partial( self._register_method, cls_or_name, flags=flags, **options )
 
-    def _register_method( self, cls_or_name, method, flags=None ):
+    def _register_method( self, cls_or_name, method, flags=None, **options ):
         """ Actually registers the given function as a method of cls_or_name. """
         clsname = getname(cls_or_name)
         if clsname not in self.classes:
@@ -106,9 +200,10 @@ class Provider( object ):
         if flags is None:
             flags = {}
         self.classes[ clsname ][ method.__name__ ] = method
-        method.EXT_argnames = inspect.getargspec( method )[0][1:]
-        method.EXT_len      = len( method.EXT_argnames )
+        self.generation += 1
+        # Argument names are introspected lazily by getargnames().
         method.EXT_flags    = flags
+        method.EXT_options  = options
         return method
 
     def build_api_dict( self ):
@@ -118,51 +213,125 @@ class Provider( object ):
             for methodname in self.classes[clsname]:
                 methinfo = {
                     "name": methodname,
-                    "len":  self.classes[clsname][methodname].EXT_len
+                    "len":  len( getargnames( self.classes[clsname][methodname] ) )
                     }
                 methinfo.update( self.classes[clsname][methodname].EXT_flags )
                 actdict[clsname].append( methinfo )
 
         return actdict
 
-    def get_api_plain( self, request ):
-        """ Introspect the methods and get a JSON description of only the API. """
-        return HttpResponse( json.dumps({
+    def build_api_json( self, actions=None ):
+        """ Introspect the methods and return a JSON description of only the API.
+
+            If actions is given, it is used instead of build_api_dict().
+        """
+        if actions is None:
+            actions = self.build_api_dict()
+        return json.dumps({
             "url":     reverse( self.request ),
             "type":    "remoting",
-            "actions": self.build_api_dict()
-            }, cls=DjangoJSONEncoder), mimetype="application/json" )
+            "actions": actions
+            }, cls=DjangoJSONEncoder)
+
+    def build_api_js( self, actions=None ):
+        """ Introspect the methods and return a javascript description of the API. """
+        lines = ["%s = %s;" % ( self.name, self.build_api_json( actions ) )]
+
+        if self.autoadd:
+            lines.append( self.build_add_provider_js() )
+
+        return "\n".join( lines )
+
+    def build_add_provider_js( self ):
+        """ Return the javascript that adds the provider to Ext.Direct. """
+        return "\n".join([
+            """Ext.Ajax.on("beforerequest", function(conn, options){"""
+            """    if( !options.headers )"""
+            """        options.headers = {};"""
+            """    options.headers["X-CSRFToken"] = Ext.util.Cookies.get("csrftoken");"""
+            """});""",
+            "Ext.Direct.addProvider( %s );" % self.name,
+            ])
+
+    def get_api_plain( self, request ):
+        """ Introspect the methods and get a JSON description of only the API. """
+        return HttpResponse( self.build_api_json(), mimetype="application/json" )
 
     def get_api( self, request ):
         """ Introspect the methods and get a javascript description of the API
             that is meant to be embedded directly into the web site.
         """
         request.META["CSRF_COOKIE_USED"] = True
-        lines = ["%s = %s;" % ( self.name, json.dumps({
-            "url":     reverse( self.request ),
-            "type":    "remoting",
-            "actions": self.build_api_dict()
-            }, cls=DjangoJSONEncoder))]
+        return HttpResponse( self.build_api_js(), mimetype="text/javascript" )
 
-        if self.autoadd:
-            lines.append(
-                """Ext.Ajax.on("beforerequest", function(conn, options){"""
-                """    if( !options.headers )"""
-                """        options.headers = {};"""
-                """    options.headers["X-CSRFToken"] = Ext.util.Cookies.get("csrftoken");"""
-                """});"""
-                )
-            lines.append( "Ext.Direct.addProvider( %s );" % self.name )
+    def build_scripts( self ):
+        """ Return a dict that maps script names to their source, for all the
+            scripts that can be rendered into a static bundle.
+        """
+        return {
+            "api.js":   self.build_api_js(),
+            "api.json": self.build_api_json(),
+            }
+
+    def load_bundle( self, manifest, baseurl ):
+        """ Reference a static bundle created by the extdirect_bundle management
+            command instead of the dynamic URLs.
+
+            manifest is the path to the manifest.json written by the command,
+            baseurl is the URL under which the bundle is served (e.g. by a CDN).
 
-        return HttpResponse( "\n".join( lines ), mimetype="text/javascript" )
+            The dynamic api.js makes Django send the csrftoken cookie that the
+            router calls need, the static one cannot. Views that render pages
+            using the bundle must therefore be decorated with ensure_csrf_cookie:
 
+            >>> from django.views.decorators.csrf import ensure_csrf_cookie
+            >>> @ensure_csrf_cookie
+            ... def index( request ):
+            ...     return render( request, "index.html", {
+            ...         "api_js": EXT_JS_PROVIDER.script_url( "api.js" ) } )
+        """
+        manifest = open( manifest, "rb" )
+        try:
+            self.bundle = json.load( manifest )
+        finally:
+            manifest.close()
+        self.bundle_url = baseurl
+
+    def script_url( self, name ):
+        """ Return the URL for the script of the given name (e.g. "api.js"),
+            pointing to the static bundle if one has been loaded.
+        """
+        if self.bundle is not None and name in self.bundle:
+            return urljoin( self.bundle_url, self.bundle[name] )
+        return reverse( { "api.js": self.get_api, "api.json": self.get_api_plain }[name] )
+
+    @csrf_exempt
     def request( self, request ):
+        """ The router view.
+
+            CsrfViewMiddleware reads request.POST before the view is called,
+            after which the upload handlers cannot be changed anymore. Hence
+            this view is exempt from the middleware, installs the upload
+            handlers and then runs the CSRF check itself (if the middleware
+            is enabled) before handing the request to route().
+        """
+        request.META["CSRF_COOKIE_USED"] = True
+        if self.upload_handlers and request.META.get("CONTENT_TYPE", "").startswith("multipart/form-data"):
+            try:
+                request.upload_handlers = [ factory( request ) for factory in self.upload_handlers ]
+            except AttributeError:
+                raise ImproperlyConfigured( "Cannot install the upload handlers because request.POST "
+                    "has already been read, probably by a middleware." )
+        if "django.middleware.csrf.CsrfViewMiddleware" in settings.MIDDLEWARE_CLASSES:
+            return self._csrf_route( request )
+        return self.route( request )
+
+    def route( self, request ):
         """ Implements the Router part of the Ext.Direct specification.
 
             It handles decoding requests, calling the appropriate function (if
             found) and encoding the response / exceptions.
         """
-        request.META["CSRF_COOKIE_USED"] = True
         # First try to use request.POST, if that doesn't work check for req.body.
         # The other way round this might make more sense because the case that uses
         # body is way more common, but accessing request.POST after body
@@ -177,25 +346,83 @@ class Provider( object ):
                 'tid':     request.POST['extTID'],
             }
         except (MultiValueDictKeyError, KeyError), err:
+            envelopes = self.get_envelopes( request )
             try:
-                rawjson = json.loads( request.body )
-            except getattr( json, "JSONDecodeError", ValueError ):
-                return HttpResponse( json.dumps({
-                    'type':    'exception',
-                    'message': 'malformed request',
-                    'where':   err.message,
-                    "tid":     None, # dunno
-                    }, cls=DjangoJSONEncoder), mimetype="application/json" )
+                if self.is_msgpack( request ):
+                    rawjson = codec.unpackb( request.body )
+                else:
+                    rawjson = json.loads( request.body )
+            except ValueError:
+                return HttpResponse( envelopes.batch([ envelopes.exception( None, 'malformed request', err.message ) ]), # tid: dunno
+                                     mimetype=envelopes.mimetype )
             else:
+                # Keep the decoded body around so others (e.g. require_authorization)
+                # don't have to decode it again.
+                request.EXT_rawjson = rawjson
+                if should_profile( request, self.profile_rate ):
+                    calls = [ "%s.%s" % ( reqinfo.get('action'), reqinfo.get('method') )
+                              for reqinfo in ( isinstance( rawjson, list ) and rawjson or [rawjson] )
+                              if isinstance( reqinfo, dict ) ]
+                    return self.profiles.run( calls, self.process_normal_request, request, rawjson )
                 return self.process_normal_request( request, rawjson )
         else:
+            if should_profile( request, self.profile_rate ):
+                calls = [ "%s.%s" % ( jsoninfo['action'], jsoninfo['method'] ) ]
+                return self.profiles.run( calls, self.process_form_request, request, jsoninfo )
             return self.process_form_request( request, jsoninfo )
 
+    def is_msgpack( self, request ):
+        """ Check if the request body is MessagePack encoded. """
+        return self.msgpack_envelopes is not None and \
+            request.META.get("CONTENT_TYPE", "").startswith( codec.MSGPACK_MIMETYPE )
+
+    def get_envelopes( self, request ):
+        """ Return the envelope builder for the response format the client asked
+            for: MessagePack if the request is MessagePack encoded or if the
+            client accepts it, JSON otherwise.
+        """
+        if self.msgpack_envelopes is not None and (
+           self.is_msgpack( request ) or codec.MSGPACK_MIMETYPE in request.META.get("HTTP_ACCEPT", "") ):
+            return self.msgpack_envelopes
+        return self.envelopes
+
+    def get_profiles( self, request, profid=None, fmt=None ):
+        """ Staff-only view that lists the stored profiles, or returns the given
+            profile either in pstats format or as collapsed stacks.
+        """
+        if not ( request.user.is_authenticated() and request.user.is_staff ):
+            return HttpResponseForbidden( "staff only" )
+
+        if profid is None:
+            return HttpResponse( json.dumps( self.profiles.list(), cls=DjangoJSONEncoder ), mimetype="application/json" )
+
+        stats = self.profiles.get( int(profid) )
+        if stats is None:
+            raise Http404( profid )
+
+        if fmt == "pstats":
+            response = HttpResponse( self.profiles.dump_pstats( stats ), mimetype="application/octet-stream" )
+            response["Content-Disposition"] = "attachment; filename=router-%s.pstats" % profid
+            return response
+        return HttpResponse( self.profiles.dump_collapsed( stats ), mimetype="text/plain" )
+
     def process_normal_request( self, request, rawjson ):
         """ Process standard requests (no form submission or file uploads). """
         if not isinstance( rawjson, list ):
             rawjson = [rawjson]
 
+        if self.batch_atomic and len(rawjson) > 1:
+            with transaction.atomic():
+                responses = self.dispatch_calls( request, rawjson, in_batch=True )
+        else:
+            responses = self.dispatch_calls( request, rawjson )
+
+        envelopes = self.get_envelopes( request )
+        return HttpResponse( envelopes.batch( responses ), mimetype=envelopes.mimetype )
+
+    def dispatch_calls( self, request, rawjson, in_batch=False ):
+        """ Call the methods requested in rawjson and return a list of encoded responses. """
+        envelopes = self.get_envelopes( request )
         responses = []
 
         for reqinfo in rawjson:
@@ -206,29 +433,20 @@ class Provider( object ):
                 reqinfo['tid'])
 
             if cls not in self.classes:
-                responses.append({
-                    'type':    'exception',
-                    'message': 'no such action',
-                    'where':   cls,
-                    "tid":     tid,
-                    })
+                responses.append( envelopes.exception( tid, 'no such action', cls, cache=True ) )
                 continue
 
             if methname not in self.classes[cls]:
-                responses.append({
-                    'type':    'exception',
-                    'message': 'no such method',
-                    'where':   methname,
-                    "tid":     tid,
-                    })
+                responses.append( envelopes.exception( tid, 'no such method', methname, cache=True ) )
                 continue
 
             func = self.classes[cls][methname]
+            argnames = getargnames( func )
 
-            if func.EXT_len and len(data) == 1 and type(data[0]) == dict:
+            if argnames and data is not None and len(data) == 1 and type(data[0]) == dict:
                 # data[0] seems to contain a dict with params. check if it does, and if so, unpack
                 args = []
-                for argname in func.EXT_argnames:
+                for argname in argnames:
                     if argname in data[0]:
                         args.append( data[0][argname] )
                     else:
@@ -242,48 +460,47 @@ class Provider( object ):
             else:
                 datalen = 0
 
-            if datalen != len(func.EXT_argnames):
-                responses.append({
-                    'type': 'exception',
-                    'tid':  tid,
-                    'message': 'invalid arguments',
-                    'where': 'Expected %d, got %d' % ( len(func.EXT_argnames), len(data) )
-                    })
+            if datalen != len(argnames):
+                responses.append( envelopes.exception( tid, 'invalid arguments',
+                    'Expected %d, got %d' % ( len(argnames), datalen ) ) )
                 continue
 
+            started = time.time()
+            stats   = None
             try:
-                if data:
-                    result = func( request, *data )
-                else:
-                    result = func( request )
+                # Count inside the transaction policy, so that the savepoint
+                # SQL isn't counted as queries made by the method.
+                with method_policy( func, in_batch ):
+                    with count_queries( self.instrument ) as stats:
+                        if getattr( func, "EXT_options", {} ).get( "offload" ):
+                            result = self.offload.apply( func, request, data or [] )
+                        elif data:
+                            result = func( request, *data )
+                        else:
+                            result = func( request )
 
             except Exception, err:
-                errinfo = {
-                    'type': 'exception',
-                    "tid":  tid,
-                    }
-                if settings.DEBUG:
-                    traceback.print_exc( file=stderr )
-                    errinfo['message'] = err.message
-                    errinfo['where']   = traceback.format_exc()
-                else:
-                    errinfo['message'] = 'The socket packet pocket has an error to report.'
-                    errinfo['where']   = ''
-                responses.append(errinfo)
+                message, where = format_error( err )
+                extra = self.report_call( cls, methname, time.time() - started, err, stats )
+                responses.append( envelopes.exception( tid, message, where, extra ) )
 
             else:
-                responses.append({
-                    "type":   rtype,
-                    "tid":    tid,
-                    "action": cls,
-                    "method": methname,
-                    "result": result
-                    })
-
-        if len(responses) == 1:
-            return HttpResponse( json.dumps( responses[0], cls=DjangoJSONEncoder ), mimetype="application/json" )
-        else:
-            return HttpResponse( json.dumps( responses, cls=DjangoJSONEncoder ),    mimetype="application/json" )
+                extra = self.report_call( cls, methname, time.time() - started, None, stats )
+                responses.append( envelopes.result( rtype, tid, cls, methname, result, extra ) )
+
+        return responses
+
+    def report_call( self, cls, methname, elapsed, error, stats ):
+        """ Pass the outcome of a call to the metrics hook, and return extra
+            fields for the response (the query stats in DEBUG mode) or None.
+        """
+        if stats is not None:
+            stats = stats.as_dict()
+        if self.metrics is not None:
+            self.metrics( cls, methname, elapsed, error, stats )
+        if stats is not None and settings.DEBUG:
+            return { 'debug': stats }
+        return None
 
     def process_form_request( self, request, reqinfo ):
         """ Router for POST requests that submit form data and/or file uploads. """
@@ -291,66 +508,197 @@ class Provider( object ):
             reqinfo['method'],
             reqinfo['type'],
             reqinfo['tid'])
+        envelopes = self.envelopes
 
         if cls not in self.classes:
-            response = {
-                'type':    'exception',
-                'message': 'no such action',
-                'where':   cls,
-                "tid":     tid,
-                }
+            response = envelopes.exception( tid, 'no such action', cls, cache=True )
 
         elif methname not in self.classes[cls]:
-            response = {
-                'type':    'exception',
-                'message': 'no such method',
-                'where':   methname,
-                "tid":     tid,
-                }
+            response = envelopes.exception( tid, 'no such method', methname, cache=True )
+
+        elif getattr( request, "EXT_upload_errors", None ):
+            # An upload handler has rejected a file, don't call the method without it.
+            response = envelopes.result( rtype, tid, cls, methname,
+                { 'success': False, 'errors': request.EXT_upload_errors } )
 
         else:
             func = self.classes[cls][methname]
+            started = time.time()
+            stats   = None
             try:
-                result = func( request )
+                with method_policy( func ):
+                    with count_queries( self.instrument ) as stats:
+                        result = func( request )
 
             except Exception, err:
-                errinfo = {
-                    'type': 'exception',
-                    "tid":  tid,
-                    }
-                if settings.DEBUG:
-                    traceback.print_exc( file=stderr )
-                    errinfo['message'] = err.message
-                    errinfo['where']   = traceback.format_exc()
-                else:
-                    errinfo['message'] = 'The socket packet pocket has an error to report.'
-                    errinfo['where']   = ''
-                response = errinfo
+                message, where = format_error( err )
+                extra = self.report_call( cls, methname, time.time() - started, err, stats )
+                response = envelopes.exception( tid, message, where, extra )
 
             else:
-                response = {
-                    "type":   rtype,
-                    "tid":    tid,
-                    "action": cls,
-                    "method": methname,
-                    "result": result
-                    }
+                extra = self.report_call( cls, methname, time.time() - started, None, stats )
+                response = envelopes.result( rtype, tid, cls, methname, result, extra )
 
         if reqinfo['upload'] == "true":
             return HttpResponse(
-                "<html><body><textarea>%s</textarea></body></html>" % json.dumps(response, cls=DjangoJSONEncoder),
+                "<html><body><textarea>%s</textarea></body></html>" % response,
                 mimetype="application/json"
                 )
         else:
-            return HttpResponse( json.dumps( response, cls=DjangoJSONEncoder ), mimetype="application/json" )
+            return HttpResponse( response, mimetype=envelopes.mimetype )
 
     def get_urls(self):
         """ Return the URL patterns. """
         pat =  patterns('',
+            (r'^profiles/$', self.get_profiles ),
+            (r'^profiles/(?P<profid>\d+)\.(?P<fmt>pstats|collapsed)$', self.get_profiles ),
             (r'api.json$', self.get_api_plain ),
             (r'api.js$',   self.get_api ),
             (r'router/?',  self.request ),
             )
         return pat
 
-    urls = property(get_urls)
+    @property
+    def urls(self):
+        """ The URL patterns, built on first access. """
+        if self._urls is None:
+            self._urls = self.get_urls()
+        return self._urls
+
+
+class ProviderGroup( Provider ):
+    """ Combines multiple Providers behind a single router and a single API
+        description, so that the browser only needs to fetch one api.js and
+        calls to actions of different Providers can be batched into a single
+        request.
+
+        Instantiation:
+
+        >>> EXT_JS_GROUP = ProviderGroup( [name="Ext.app.REMOTING_API", autoadd=True] )
+        >>> EXT_JS_GROUP.add_provider( billing.views.EXT_JS_PROVIDER, namespace="billing" )
+        >>> EXT_JS_GROUP.add_provider( reports.views.EXT_JS_PROVIDER )
+
+        Then include EXT_JS_GROUP.urls instead of the urls of the member
+        Providers (FormProviders still need their own urls for the form
+        scripts).
+
+        Actions of a Provider that has been added with a namespace are exported
+        as "<namespace>.<action>". The Ext 3 RemotingProvider does not resolve
+        that to nested objects, but assigns the action to a property of that
+        name in its namespace (window by default), so it has to be accessed
+        with the subscript operator:
+
+            window["billing.Invoice"].list( function(result){ ... } );
+
+        Actions of Providers added without a namespace are exported under their
+        plain name, which is what the scripts generated by FormProvider expect.
+
+        The api.js and api.json views accept a "namespaces" GET parameter with
+        a comma separated list of namespaces to include, so that pages can load
+        only the action lists they need. Actions without a namespace are always
+        included. Further namespaces can be loaded later on the same page by
+        loading another api.js?namespaces=...: if the group's provider has
+        already been added, that script only adds the new actions to it, so
+        all calls keep being batched by a single provider.
+
+        Methods registered to member Providers after they have been added are
+        picked up automatically.
+    """
+
+    def __init__( self, name="Ext.app.REMOTING_API", autoadd=True, **kwargs ):
+        self.providers  = []
+        self._merged    = None
+        self._mergedgen = None
+        Provider.__init__( self, name=name, autoadd=autoadd, **kwargs )
+
+    def add_provider( self, provider, namespace=None ):
+        """ Add a Provider to this group, optionally under the given namespace. """
+        for clsname in provider.classes:
+            if namespace is not None:
+                clsname = "%s.%s" % ( namespace, clsname )
+            if clsname in self.classes:
+                raise ValueError( "Action '%s' is already defined in this group." % clsname )
+        self.providers.append( ( namespace, provider ) )
+        self._merged = None
+        return provider
+
+    def _get_classes( self ):
+        """ Merge the actions of this group and all member Providers into one
+            dict, which is cached until a Provider registers another method.
+        """
+        gen = tuple([ self.generation ] + [ provider.generation for (namespace, provider) in self.providers ])
+        if self._merged is None or self._mergedgen != gen:
+            merged = dict( self._classes )
+            for namespace, provider in self.providers:
+                for clsname in provider.classes:
+                    if namespace is not None:
+                        merged.setdefault( "%s.%s" % ( namespace, clsname ), provider.classes[clsname] )
+                    else:
+                        merged.setdefault( clsname, provider.classes[clsname] )
+            self._merged    = merged
+            self._mergedgen = gen
+        return self._merged
+
+    def _set_classes( self, classes ):
+        self._classes = classes
+        self._merged  = None
+
+    classes = property( _get_classes, _set_classes )
+
+    def _register_method( self, cls_or_name, method, flags=None, **options ):
+        """ Register a method to the group itself. """
+        clsname = getname(cls_or_name)
+        if clsname not in self._classes:
+            self._classes[clsname] = {}
+        self._merged = None
+        return Provider._register_method( self, clsname, method, flags=flags, **options )
+
+    def build_api_dict( self, namespaces=None ):
+        """ Build the actions dict, optionally only for the given namespaces. """
+        actdict = Provider.build_api_dict( self )
+        if namespaces is None:
+            return actdict
+        return dict([ ( clsname, actdict[clsname] ) for clsname in actdict
+                      if "." not in clsname or clsname.split(".", 1)[0] in namespaces ])
+
+    def build_api_json( self, actions=None ):
+        """ Like Provider.build_api_json, but gives the provider an id by which
+            later api.js loads can find it, see build_add_provider_js.
+        """
+        if actions is None:
+            actions = self.build_api_dict()
+        return json.dumps({
+            "id":      self.name,
+            "url":     reverse( self.request ),
+            "type":    "remoting",
+            "actions": actions
+            }, cls=DjangoJSONEncoder)
+
+    def build_add_provider_js( self ):
+        """ Add the provider to Ext.Direct, or if it has already been added by an
+            earlier api.js of this group, only add the actions to it.
+        """
+        provider = "Ext.Direct.getProvider( %s )" % json.dumps( self.name )
+        return "\n".join([
+            "if( %s ){" % provider,
+            "    Ext.apply( %s, { actions: %s.actions } ).initAPI();" % ( provider, self.name ),
+            "}",
+            "else {",
+            Provider.build_add_provider_js( self ),
+            "}",
+            ])
+
+    def get_namespaces( self, request ):
+        """ Return the namespaces requested in the "namespaces" GET parameter, or None for all. """
+        if not request.GET.get("namespaces"):
+            return None
+        return request.GET["namespaces"].split(",")
+
+    def get_api_plain( self, request ):
+        actions = self.build_api_dict( self.get_namespaces( request ) )
+        return HttpResponse( self.build_api_json( actions ), mimetype="application/json" )
+
+    def get_api( self, request ):
+        request.META["CSRF_COOKIE_USED"] = True
+        actions = self.build_api_dict( self.get_namespaces( request ) )
+        return HttpResponse( self.build_api_js( actions ), mimetype="text/javascript" )
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+from threading import local
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.conf import settings
+
+_state = local()
+
+
+class ReplicaRouter( object ):
+    """ Database router that sends all reads made by methods registered with
+        replica=True to the replica database.
+
+        Add it in front of your other routers:
+
+            DATABASE_ROUTERS = ['djextdirect.transactions.ReplicaRouter']
+
+        The replica's alias is taken from the EXTDIRECT_REPLICA_DB setting
+        (default "replica"), unless the method was registered with the alias
+        as the value of the replica option, e.g. replica="reporting".
+    """
+
+    def db_for_read( self, model, **hints ):
+        return getattr( _state, "read_db", None )
+
+    def db_for_write( self, model, **hints ):
+        return None
+
+    def allow_relation( self, obj1, obj2, **hints ):
+        return None
+
+    def allow_syncdb( self, db, model ):
+        return None
+
+
+@contextmanager
+def use_replica( alias=None ):
+    """ Route reads made within the block to the given replica database. """
+    if alias is None or alias is True:
+        alias = getattr( settings, "EXTDIRECT_REPLICA_DB", "replica" )
+    previous = getattr( _state, "read_db", None )
+    _state.read_db = alias
+    try:
+        yield
+    finally:
+        _state.read_db = previous
+
+
+@contextmanager
+def method_policy( func, in_batch=False ):
+    """ Apply the transaction options func has been registered with.
+
+        Methods registered with replica=True read from the replica database,
+        methods registered with atomic=True run in a transaction. If in_batch
+        is True, the call is part of a batch that runs in a single transaction,
+        and every method gets its own savepoint, so that a failing call only
+        rolls back its own changes.
+
+        The options combine: a replica method that is atomic or part of a
+        batch reads from the replica inside a transaction on the default
+        database.
+    """
+    options = getattr( func, "EXT_options", {} )
+    with use_replica( options["replica"] ) if options.get("replica") else _noop():
+        if options.get("atomic") or in_batch:
+            with transaction.atomic():
+                yield
+        else:
+            yield
+
+
+@contextmanager
+def _noop():
+    yield
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  djExtDirect is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+from django.core.files.uploadedfile  import TemporaryUploadedFile
+
+
+class StreamingUploadHandler( FileUploadHandler ):
+    """ Upload handler that streams uploaded files to temporary files chunk by
+        chunk, so that large uploads never have to be kept in memory.
+
+        Pass a factory for this handler to the Provider to have it installed
+        for form requests before the request body is parsed:
+
+        >>> EXT_JS_PROVIDER = FormProvider( upload_handlers=[
+        ...     functools.partial( StreamingUploadHandler, max_size=50*1024*1024 )
+        ...     ] )
+
+        Parameters:
+
+        max_size:        Maximum size of a single file in bytes. If a file
+                         exceeds this size, the rest of it is discarded, the
+                         file is left out of request.FILES and the error is
+                         recorded in request.EXT_upload_errors (a dict that
+                         maps field names to messages), which makes the
+                         Provider answer the form request with a failure.
+        hash_algorithm:  Name of a hashlib algorithm used to hash the content
+                         while it is being received. The hex digest is stored
+                         in the EXT_hash attribute of the uploaded file. Set
+                         to None to disable hashing.
+        progress:        A function that gets called after each chunk with the
+                         request, the field name, the file name, the number of
+                         bytes received so far and the content length of the
+                         request (which may be None). This can be used to
+                         publish progress events through a PollingProvider.
+        storage:         A Django storage backend. If given, each file is
+                         copied to the storage under a name derived from its
+                         hash, unless a file with that name already exists.
+                         The storage name is stored in the EXT_storage_name
+                         attribute of the uploaded file.
+    """
+
+    def __init__( self, request=None, max_size=None, hash_algorithm="sha1", progress=None, storage=None ):
+        FileUploadHandler.__init__( self, request )
+        self.max_size       = max_size
+        self.hash_algorithm = hash_algorithm
+        self.progress       = progress
+        self.storage        = storage
+        self.content_length = None
+
+    def handle_raw_input( self, input_data, META, content_length, boundary, encoding=None ):
+        self.content_length = content_length
+        return None
+
+    def new_file( self, *args, **kwargs ):
+        FileUploadHandler.new_file( self, *args, **kwargs )
+        self.file = TemporaryUploadedFile( self.file_name, self.content_type, 0, self.charset )
+        self.received = 0
+        self.too_large = False
+        if self.hash_algorithm is not None:
+            self.hasher = hashlib.new( self.hash_algorithm )
+        else:
+            self.hasher = None
+
+    def receive_data_chunk( self, raw_data, start ):
+        if self.too_large:
+            return None
+        self.received += len(raw_data)
+        if self.max_size is not None and self.received > self.max_size:
+            # Keep parsing the rest of the request (the Ext.Direct fields
+            # usually come after the files), but drop the data of this file.
+            self.too_large = True
+            self.file.close()
+            if self.request is not None:
+                if not hasattr( self.request, "EXT_upload_errors" ):
+                    self.request.EXT_upload_errors = {}
+                self.request.EXT_upload_errors[self.field_name] = "file too large"
+            return None
+        if self.hasher is not None:
+            self.hasher.update( raw_data )
+        self.file.write( raw_data )
+        if self.progress is not None:
+            self.progress( self.request, self.field_name, self.file_name, self.received, self.content_length )
+        return None
+
+    def file_complete( self, file_size ):
+        if self.too_large:
+            return None
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.EXT_hash = None
+        self.file.EXT_storage_name = None
+
+        if self.hasher is not None:
+            self.file.EXT_hash = self.hasher.hexdigest()
+
+            if self.storage is not None:
+                ext = os.path.splitext( self.file_name )[1]
+                name = "%s/%s/%s%s" % ( self.file.EXT_hash[:2], self.file.EXT_hash[2:4], self.file.EXT_hash, ext )
+                if not self.storage.exists( name ):
+                    name = self.storage.save( name, self.file )
+                    self.file.seek(0)
+                self.file.EXT_storage_name = name
+
+        return self.file
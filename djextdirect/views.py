@@ -15,11 +15,13 @@
  *  GNU General Public License for more details.
 """
 
+from auth import authenticate_cached
+
 def login( request, username, passwd ):
-    from django.contrib.auth import authenticate, login as djlogin
+    from django.contrib.auth import login as djlogin
     if request.user.is_authenticated():
         return { 'success': True }
-    user = authenticate( username=username, password=passwd )
+    user = authenticate_cached( username, passwd )
     if user:
         if user.is_active:
             djlogin( request, user )
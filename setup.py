@@ -11,7 +11,7 @@ setup(name='djextdirect',
     author_email='diese-addy@funzt-halt.net',
     url='http://bitbucket.org/Svedrin/djextdirect/downloads',
     download_url=('http://bitbucket.org/Svedrin/djextdirect/get/v%d.%d.tar.bz2' % VERSION),
-    packages=['djextdirect'],
+    packages=['djextdirect', 'djextdirect.management', 'djextdirect.management.commands'],
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Web Environment',